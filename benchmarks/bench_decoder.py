@@ -0,0 +1,98 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+'''
+Micro-benchmark for the AS7262 frame decoder.
+Compares the generic JSON path used before by AS7262Protocol.lineReceived
+against the fast path decoder in calas7262.frame.
+
+Usage: python benchmarks/bench_decoder.py [-n LINES]
+'''
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import, print_function
+
+import os
+import sys
+import json
+import time
+import datetime
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+#--------------
+# local imports
+# -------------
+
+from calas7262.frame import AS7262_KEYS, OPT3001_KEYS, decode, decodeJSON, makeReading
+
+# ----------------
+# Module constants
+# ----------------
+
+AS7262_LINE  = b'["A",1234,5678901,1,357,16,28,1523.41,1501,2210.9,2187,3012.55,2999,1833.12,1799,987.6,960,512.2,498]'
+OPT3001_LINE = b'["O",1234,5678901,1,800,103.52]'
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def legacy(line):
+    '''The decoding path used by lineReceived() before the fast path'''
+    now = datetime.datetime.utcnow()
+    contents = json.loads(line.decode('utf-8'))
+    contents[0] = "AS7262" if contents[0] == "A" else "OPT3001"
+    if contents[0] == "AS7262":
+        contents = list(zip(AS7262_KEYS, contents))
+    else:
+        contents = list(zip(OPT3001_KEYS, contents))
+    contents.append(('tstamp', now))
+    return dict(contents)
+
+
+def fast(line):
+    '''The decoding path used by lineReceived() now'''
+    now = time.time()
+    contents = decode(line)
+    if contents is None:
+        contents = decodeJSON(line)
+    return makeReading(contents, now)
+
+
+def measure(func, lines):
+    t0 = time.time()
+    for line in lines:
+        func(line)
+    return len(lines) / (time.time() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_decoder')
+    parser.add_argument('-n', '--lines', type=int, default=200000, help='number of lines to decode')
+    opts = parser.parse_args()
+
+    lines = [AS7262_LINE] * opts.lines
+    mixed = [AS7262_LINE, OPT3001_LINE] * (opts.lines // 2)
+
+    # Both paths must agree before timing anything
+    for line in (AS7262_LINE, OPT3001_LINE):
+        a, b = legacy(line), fast(line)
+        del a['tstamp']
+        assert a == dict(zip(b._fields[:-1], b)), (a, b)
+
+    print("{0:<12} {1:>14} {2:>14} {3:>8}".format("Frames", "legacy (l/s)", "fast (l/s)", "speedup"))
+    for name, data in (("AS7262", lines), ("mixed", mixed)):
+        before = measure(legacy, data)
+        after  = measure(fast, data)
+        print("{0:<12} {1:>14.0f} {2:>14.0f} {3:>7.2f}x".format(name, before, after, after/before))
+
+
+if __name__ == '__main__':
+    main()
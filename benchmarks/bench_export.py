@@ -0,0 +1,115 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+'''
+Benchmark for the samples CSV export.
+Compares the former per sample row building (datetime + strftime for
+every row, list concatenation) with calas7262.export bulk formatting,
+writing both to scratch files and checking they are identical.
+
+Usage: python benchmarks/bench_export.py [-n SAMPLES] [-r RATE]
+'''
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import, print_function
+
+import os
+import sys
+import csv
+import time
+import random
+import datetime
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+#--------------
+# local imports
+# -------------
+
+from calas7262.frame   import AS7262_KEYS, AS7262Reading
+from calas7262.samples import SampleStore
+from calas7262.export  import TSTAMP_FORMAT, SAMPLES_HEADER, exportSamples
+
+# ----------------
+# Module constants
+# ----------------
+
+META = (500, 1.0e-9, '0.632')
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def makeStore(n, rate):
+    '''SampleStore with n synthetic readings, at rate readings per second'''
+    store = SampleStore()
+    t0 = time.time()
+    rnd = random.Random(1)
+    for i in range(n):
+        bands = []
+        for flux in (11500.0, 17900.0, 24000.0, 14800.0, 7900.0, 4000.0):
+            value = round(flux * (1 + rnd.gauss(0, 0.01)), 2)
+            bands.extend((value, int(value / 2.8)))
+        store.append(AS7262Reading('AS7262', i, i * 357, 1, 357.0, 16, 28, *(bands + [t0 + i / rate])))
+    return store
+
+
+def legacy(fd, samples, meta):
+    '''The former saveSamples() row building'''
+    w, current, qe = meta
+    nfields = len(AS7262_KEYS)
+    rows = []
+    for sample in samples:
+        tstamp = datetime.datetime.utcfromtimestamp(sample.tstamp + 0.5).strftime(TSTAMP_FORMAT)
+        rows.append([tstamp, w, current, qe] + list(sample[:nfields]))
+    writer = csv.writer(fd, delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+    writer.writerow(SAMPLES_HEADER)
+    writer.writerows(rows)
+    return len(rows)
+
+
+def run(name, func, samples, path):
+    with open(path, 'w') as fd:
+        t0 = time.time()
+        n = func(fd, samples, META)
+        fd.flush()
+        elapsed = time.time() - t0
+    size = os.path.getsize(path)
+    print("{0:<8} {1} rows in {2:.2f} s: {3:>10.0f} rows/s {4:>6.1f} MB/s".format(name, n, elapsed, n / elapsed, size / elapsed / 1e6))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_export')
+    parser.add_argument('-n', '--samples', type=int, default=1000000, help='number of samples')
+    parser.add_argument('-r', '--rate', type=float, default=3.0, help='samples per second (timestamp spacing)')
+    opts = parser.parse_args()
+
+    print("building {0} samples ...".format(opts.samples))
+    samples = makeStore(opts.samples, opts.rate)
+    workdir = tempfile.mkdtemp(prefix='calas7262-bench-')
+    path1 = os.path.join(workdir, 'legacy.csv')
+    path2 = os.path.join(workdir, 'bulk.csv')
+    try:
+        t1 = run('legacy', legacy, samples, path1)
+        t2 = run('bulk', exportSamples, samples, path2)
+        with open(path1) as fd1, open(path2) as fd2:
+            same = fd1.read() == fd2.read()
+        print("speedup x{0:.1f}, identical output: {1}".format(t1 / t2, same))
+    finally:
+        for path in (path1, path2):
+            if os.path.exists(path):
+                os.remove(path)
+        os.rmdir(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+'''
+End to end throughput and latency benchmark.
+
+Drives the full AS7262ProtocolFactory -> SerialService -> AS7262Service.onReading
+-> StatsService.accumulate -> StorageService chain with synthetic frames,
+replayed as fast as possible through the replay: endpoint, and reports
+frames/second, per stage latency percentiles, peak RSS and CSV write
+throughput. Results are saved as JSON to compare across versions.
+
+The application runs unchanged in automatic mode (start on device
+readiness, save and quit once statistics are complete), only the
+console output is discarded.
+
+Stages time only their own work: the line callbacks and the queue
+consumer, which run synchronously downstream, are not included in the
+decode and store stages.
+
+Usage: python benchmarks/bench_pipeline.py [-n FRAMES] [-o RESULTS.json] [-- calas7262 options]
+'''
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import, print_function
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.application.service import IService
+
+#--------------
+# local imports
+# -------------
+
+from calas7262           import __version__
+from calas7262.config    import cmdline_options
+from calas7262.logger    import startLogging
+from calas7262.application import makeApplication
+from calas7262.as7262    import AS7262Service
+from calas7262.stats     import StatsService
+from calas7262.console   import ConsoleService
+from calas7262.storage   import StorageService
+from calas7262           import protocol
+from calas7262.samples   import SampleStore
+from calas7262.workers   import WorkerPool
+from calas7262.simulator import Simulator
+from calas7262.bandstats import summarize
+
+# ----------------
+# Module constants
+# ----------------
+
+# Stage name, class (or module) and function timed
+STAGES = [
+    ('decode',  protocol,       'decode'),
+    ('store',   SampleStore,    'append'),
+    ('compute', StatsService,   'computeStats'),
+    ('format',  StatsService,   'formatStats'),
+    ('pool',    WorkerPool,     'run'),
+    ('save',    StorageService, 'onCalibrationSave'),
+]
+
+# Mark name, class and method whose first call time is recorded
+MARKS = [
+    ('start',   AS7262Service,  'onCalibrationStart'),
+    ('end',     StorageService, 'onAcquisitionEnd'),
+]
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+timings = dict( (name, []) for name, _, _ in STAGES )
+
+marks = {}
+
+# -------
+# Classes
+# -------
+
+class NullConsole(ConsoleService):
+    '''Console writing to /dev/null and not reading stdin, so the benchmark is not disturbed'''
+
+    def startService(self):
+        self.stdio = open(os.devnull, 'w')
+
+    def stopService(self):
+        self.stdio.close()
+        return ConsoleService.stopService(self)
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def timed(name, func):
+    '''Times a method call, until its result fires if it is a Deferred'''
+    samples = timings[name]
+    clock = time.time
+    def done(result, t0):
+        samples.append(clock() - t0)
+        return result
+    def wrapper(*args, **kwargs):
+        t0 = clock()
+        result = func(*args, **kwargs)
+        if isinstance(result, Deferred):
+            result.addBoth(done, t0)
+        else:
+            done(result, t0)
+        return result
+    return wrapper
+
+
+def marked(name, func):
+    '''Records the time of the first call to a method'''
+    def wrapper(*args, **kwargs):
+        marks.setdefault(name, time.time())
+        return func(*args, **kwargs)
+    return wrapper
+
+
+def instrument():
+    for name, cls, method in STAGES:
+        setattr(cls, method, timed(name, getattr(cls, method)))
+    for name, cls, method in MARKS:
+        setattr(cls, method, marked(name, getattr(cls, method)))
+
+
+def makeCapture(path, frames, seed):
+    '''Synthetic text capture: boot banner followed by frames'''
+    options = argparse.Namespace(rate=1000.0, lux_every=1, noise=0.01, gain=16,
+        exptime=357.0, temp=28, banner_period=2.0, seed=seed)
+    simulator = Simulator(options)
+    with open(path, 'wb') as fd:
+        fd.write(b'not json\r\n' * 6)
+        for i in range(0, frames, 1000):
+            fd.write(simulator.frames(min(1000, frames - i)))
+
+
+def stageReport(name):
+    values = timings[name]
+    if not values:
+        return None
+    entry = summarize([name], [values], percentiles=(90, 99), use_numpy=False)[name]
+    return {
+        'count'   : entry['n'],
+        'mean_us' : entry['mean'] * 1e6,
+        'p50_us'  : entry['median'] * 1e6,
+        'p90_us'  : entry['p90'] * 1e6,
+        'p99_us'  : entry['p99'] * 1e6,
+        'max_us'  : entry['max'] * 1e6,
+        'total_s' : sum(values),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_pipeline')
+    parser.add_argument('-n', '--frames', type=int, default=100000, help='number of AS7262 frames')
+    parser.add_argument('-o', '--output', type=str, default=None, help='JSON results file')
+    parser.add_argument('--seed', type=int, default=1, help='synthetic data random seed')
+    parser.add_argument('--keep', action='store_true', help='keep the generated capture and CSV files')
+    parser.add_argument('extra', nargs='*', help='extra calas7262 options (after --)')
+    opts = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='calas7262-bench-')
+    capture = os.path.join(workdir, 'capture.txt')
+    makeCapture(capture, opts.frames, opts.seed)
+
+    sys.argv = ['calas7262', '-a', '-w', '500', '-d', '1.0e-9', '-s', str(opts.frames),
+        '--log-file', '', '--replay', capture, '--replay-speed', 'max',
+        '-c', os.path.join(workdir, 'stats.csv'), '-m', os.path.join(workdir, 'samples.csv'), '--csv-lux', os.path.join(workdir, 'lux.csv')] + opts.extra
+    options, cmd_opts = cmdline_options()
+    startLogging(console=False, filepath=cmd_opts.log_file)
+
+    instrument()
+    application = makeApplication(options, consoleClass=NullConsole)
+    IService(application).startService()
+    reactor.run()
+    if 'end' not in marks:
+        sys.exit("acquisition did not complete")
+
+    elapsed = marks['end'] - marks['start']
+    samples_csv = options['storage']['csv_samples']
+    save = stageReport('save')
+    results = {
+        'version'   : __version__,
+        'python'    : platform.python_version(),
+        'platform'  : platform.platform(),
+        'timestamp' : time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        'options'   : sys.argv[1:],
+        'frames'    : opts.frames,
+        'elapsed_s' : elapsed,
+        'frames_per_second' : opts.frames / elapsed,
+        'stages'    : dict( (name, stageReport(name)) for name, _, _ in STAGES ),
+        'peak_rss_kb' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'csv'       : {
+            'rows'     : opts.frames,
+            'bytes'    : os.path.getsize(samples_csv) if os.path.exists(samples_csv) else 0,
+        },
+    }
+    if save is not None:
+        results['csv']['rows_per_second'] = opts.frames / save['total_s']
+        results['csv']['mb_per_second']   = results['csv']['bytes'] / save['total_s'] / 1e6
+    if opts.keep:
+        print("output files kept in {0}".format(workdir), file=sys.__stdout__)
+    else:
+        shutil.rmtree(workdir)
+
+    # Twisted logging has redirected sys.stdout
+    out = sys.__stdout__
+    print("{0} frames in {1:.2f} s: {2:.0f} frames/s, peak RSS {3} KiB".format(
+        opts.frames, elapsed, results['frames_per_second'], results['peak_rss_kb']), file=out)
+    for name, _, _ in STAGES:
+        stage = results['stages'][name]
+        if stage is not None:
+            print("{0:<8} n={1:<8} p50={2:>10.1f} us  p90={3:>10.1f} us  p99={4:>10.1f} us  max={5:>12.1f} us".format(
+                name, stage['count'], stage['p50_us'], stage['p90_us'], stage['p99_us'], stage['max_us']), file=out)
+        else:
+            print("{0:<8} not run in this process".format(name), file=out)
+    if results['stages']['pool'] is not None:
+        print("pool: compute and format round trip to the worker processes", file=out)
+    if 'rows_per_second' in results['csv']:
+        print("CSV export: {0:.0f} rows/s, {1:.1f} MB/s".format(results['csv']['rows_per_second'], results['csv']['mb_per_second']), file=out)
+    output = opts.output or 'bench-pipeline-{0}.json'.format(__version__)
+    with open(output, 'w') as fd:
+        json.dump(results, fd, indent=2, sort_keys=True)
+    print("results saved to {0}".format(output), file=out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+'''
+Startup time benchmark.
+
+Times fresh interpreters running "python -m calas7262 --version" and
+"--help", which exit after parsing the command line, and importing the
+whole application (every service module), which is paid before the
+prompt shows up. Results are saved as JSON to compare across versions.
+
+Usage: python benchmarks/bench_startup.py [-n RUNS] [-o RESULTS.json]
+'''
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import, print_function
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+sys.path.insert(0, ROOT)
+
+#--------------
+# local imports
+# -------------
+
+from calas7262 import __version__
+
+# ----------------
+# Module constants
+# ----------------
+
+# Case name and interpreter arguments
+CASES = [
+    ('python',    ['-c', 'pass']),
+    ('version',   ['-m', 'calas7262', '--version']),
+    ('help',      ['-m', 'calas7262', '--help']),
+    ('import',    ['-c', 'import calas7262.application']),
+]
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def measure(args, runs):
+    '''Wall clock seconds of each run of a fresh interpreter'''
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(runs):
+            t0 = time.time()
+            if subprocess.call([sys.executable] + args, stdout=devnull, stderr=devnull, env=env, cwd=ROOT) != 0:
+                sys.exit("{0} failed".format(" ".join(args)))
+            times.append(time.time() - t0)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_startup')
+    parser.add_argument('-n', '--runs', type=int, default=10, help='runs per case')
+    parser.add_argument('-o', '--output', type=str, default=None, help='JSON results file')
+    opts = parser.parse_args()
+
+    results = {
+        'version'   : __version__,
+        'python'    : platform.python_version(),
+        'platform'  : platform.platform(),
+        'timestamp' : time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        'runs'      : opts.runs,
+        'cases'     : {},
+    }
+    print("{0:<10} {1:>10} {2:>12} {3:>10}".format("Case", "min (ms)", "median (ms)", "max (ms)"))
+    for name, args in CASES:
+        times = sorted(measure(args, opts.runs))
+        entry = results['cases'][name] = {
+            'min_ms'    : times[0] * 1e3,
+            'median_ms' : times[len(times) // 2] * 1e3,
+            'max_ms'    : times[-1] * 1e3,
+        }
+        print("{0:<10} {1:>10.1f} {2:>12.1f} {3:>10.1f}".format(name, entry['min_ms'], entry['median_ms'], entry['max_ms']))
+    output = opts.output or 'bench-startup-{0}.json'.format(__version__)
+    with open(output, 'w') as fd:
+        json.dump(results, fd, indent=2, sort_keys=True)
+    print("results saved to {0}".format(output))
+
+
+if __name__ == '__main__':
+    main()
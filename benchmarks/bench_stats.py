@@ -0,0 +1,104 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+'''
+Benchmark for the per band statistics engine.
+Compares the former StatsService.computeStats implementation
+(statistics.mean/stdev per band) with calas7262.bandstats.summarize(),
+both with NumPy (if installed) and with its pure Python fallback.
+
+Usage: python benchmarks/bench_stats.py [-s SIZE [SIZE ...]]
+'''
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import, print_function
+
+import os
+import sys
+import time
+import random
+import argparse
+
+from array import array
+
+try:
+    import statistics
+except ImportError:
+    statistics = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+#--------------
+# local imports
+# -------------
+
+from calas7262.frame     import COLOUR_KEYS
+from calas7262.bandstats import summarize, numpy
+
+# ----------------
+# Module constants
+# ----------------
+
+SIZES = [5, 50, 500, 5000, 50000, 100000]
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def legacy(keys, columns):
+    '''The former computeStats() inner loop'''
+    result = {}
+    for key, column in zip(keys, columns):
+        central = statistics.mean(column)
+        stddev  = statistics.stdev(column, central)
+        result[key] = (central, stddev)
+    return result
+
+
+def window(n):
+    columns = []
+    for key in COLOUR_KEYS:
+        if key.startswith('raw_'):
+            columns.append(array('l', [int(random.gauss(1500, 40)) for i in range(n)]))
+        else:
+            columns.append(array('d', [random.gauss(1500.0, 40.0) for i in range(n)]))
+    return columns
+
+
+def measure(func, *args):
+    '''Returns the best time per call of a few calls, in milliseconds'''
+    best = None
+    t_end = time.time() + 0.5
+    while best is None or time.time() < t_end:
+        t0 = time.time()
+        func(*args)
+        elapsed = time.time() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='bench_stats')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=SIZES, help='window sizes')
+    opts = parser.parse_args()
+
+    def fmt(value):
+        return "{0:>12.3f}".format(value) if value is not None else "{0:>12}".format("n/a")
+
+    print("{0:>8} {1:>12} {2:>12} {3:>12}  (ms per 12 band window)".format("Size", "statistics", "pure", "numpy"))
+    for n in opts.sizes:
+        columns = window(n)
+        before = measure(legacy, COLOUR_KEYS, columns) if statistics is not None else None
+        pure   = measure(summarize, COLOUR_KEYS, columns, (5, 25, 75, 95), False)
+        vector = measure(summarize, COLOUR_KEYS, columns, (5, 25, 75, 95), True) if numpy is not None else None
+        print("{0:>8} {1} {2} {3}".format(n, fmt(before), fmt(pure), fmt(vector)))
+
+
+if __name__ == '__main__':
+    main()
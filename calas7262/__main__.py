@@ -28,4 +28,6 @@ from __future__ import division, absolute_import
 # -----------------------
 
 
-import calas7262.main_posix
+from calas7262.main_posix import main
+
+main()
@@ -10,62 +10,62 @@
 
 from __future__ import division, absolute_import
 
-import os.path
-
 # ---------------
 # Twisted imports
 # ---------------
 
-from twisted.internet import reactor
-
 #--------------
 # local imports
 # -------------
 
 from calas7262.service.reloadable import Application
-from calas7262.logger import sysLogInfo,  startLogging
-from calas7262.config import VERSION_STRING, cmdline_options
-
+from calas7262.utils  import serviceName
 
 from calas7262.as7262    import AS7262Service
 from calas7262.serial    import SerialService 
 from calas7262.stats     import StatsService    
+from calas7262.luxstats  import LuxStatsService
 from calas7262.console   import ConsoleService
 from calas7262.storage   import StorageService    
 
-# Read the command line arguments
-options, cmd_opts  = cmdline_options()
+# ------------------------
+# Module Utility Functions
+# ------------------------
 
-startLogging(console=cmd_opts.console, filepath=cmd_opts.log_file)
+def makeApplication(options, consoleClass=ConsoleService):
+    '''
+    Assemble application from its service components.
+    The console service class may be replaced (i.e. by benchmarks).
+    '''
+    application = Application("as7262")
 
-# ------------------------------------------------
-# Assemble application from its service components
-# ------------------------------------------------
+    as7262Service  = AS7262Service(options['as7262'])
+    as7262Service.setName(AS7262Service.NAME)
+    as7262Service.setServiceParent(application)
 
-application = Application("as7262")
+    serialService = SerialService(options['serial'])
+    serialService.setName(SerialService.NAME)
+    serialService.setServiceParent(as7262Service)
 
-as7262Service  = AS7262Service(options['as7262'])
-as7262Service.setName(AS7262Service.NAME)
-as7262Service.setServiceParent(application)
+    # One statistics pipeline per calibrated device
+    for device in options['as7262']['devices']:
+        statsService = StatsService(options['stats'], device)
+        statsService.setName(serviceName(StatsService.NAME, device))
+        statsService.setServiceParent(as7262Service)
 
-serialService = SerialService(options['serial'])
-serialService.setName(SerialService.NAME)
-serialService.setServiceParent(as7262Service)
+        luxService = LuxStatsService(options['lux'], device)
+        luxService.setName(serviceName(LuxStatsService.NAME, device))
+        luxService.setServiceParent(as7262Service)
 
-statsService = StatsService(options['stats'])
-statsService.setName(StatsService.NAME)
-statsService.setServiceParent(as7262Service)
+    consoService = consoleClass(options['console'])
+    consoService.setName(ConsoleService.NAME)
+    consoService.setServiceParent(as7262Service)
 
-consoService = ConsoleService(options['console'])
-consoService.setName(ConsoleService.NAME)
-consoService.setServiceParent(as7262Service)
+    storageService = StorageService(options['storage'])
+    storageService.setName(StorageService.NAME)
+    storageService.setServiceParent(as7262Service)
 
-storageService = StorageService(options['storage'])
-storageService.setName(StorageService.NAME)
-storageService.setServiceParent(as7262Service)
+    return application
 
-# --------------------------------------------------------
-# Store direct links to subservices in our manager service
-# --------------------------------------------------------
 
-__all__ = [ "application" ]
+__all__ = [ "makeApplication" ]
@@ -11,6 +11,8 @@
 
 from __future__ import division, absolute_import
 
+from functools import partial
+
 # -------------
 # Other modules
 # -------------
@@ -23,21 +25,26 @@ from __future__ import division, absolute_import
 from twisted                   import __version__ as __twisted_version__
 from twisted.logger            import Logger, LogLevel
 from twisted.internet          import task, reactor, defer
-from twisted.internet.defer    import Deferred, inlineCallbacks, returnValue, DeferredQueue
+from twisted.internet.defer    import Deferred, inlineCallbacks, returnValue
 
 #--------------
 # local imports
 # -------------
 
-from calas7262        import __version__
+from calas7262        import __version__, metrics
 from calas7262.logger import setLogLevel
+from calas7262.utils  import serviceName
 
 from calas7262.service.reloadable import MultiService
 from calas7262.protocol import AS7262ProtocolFactory
 from calas7262.serial   import SerialService
 from calas7262.stats    import StatsService    
+from calas7262.luxstats import LuxStatsService
 from calas7262.console  import ConsoleService
 from calas7262.storage  import StorageService
+from calas7262.samples  import SampleStore
+from calas7262.queues   import BoundedQueue
+from calas7262.workers  import WorkerPool
 
 # ----------------
 # Module constants
@@ -63,8 +70,8 @@ class AS7262Service(MultiService):
     # Queue names, by priority
     QNAMES = ['AS7262','OPT3001']
   
-    # Queue sizes
-    QSIZES = [ 15, 15, 10, 10*24*60, 10*24*60]
+    # Default queue sizes, same order as QNAMES
+    QSIZES = [ 1024, 64 ]
 
 
     def __init__(self, options):
@@ -72,15 +79,35 @@ class AS7262Service(MultiService):
         setLogLevel(namespace='as7262', levelStr=options['log_level'])
         self.options        = options
         self.serialService  = None
-        self.statsService   = None
+        self.statsServices  = {}
+        self.luxServices    = {}
         self.consoService   = None
         self.storageService = None
         self.factory        = AS7262ProtocolFactory()
-        self.queue          = { 
-            'AS7262'  : DeferredQueue(),
-            'OPT3001' : DeferredQueue(), 
-        }
-        self.stats = {}  
+        # Every device has its own queues, samples and statistics services
+        self.devices        = options['devices']
+        sizes = dict(zip(self.QNAMES, self.QSIZES))
+        if options['queue_size'] is not None:
+            sizes['AS7262'] = options['queue_size']
+        self.queues = {}
+        for device in self.devices:
+            prefix = device + '/' if len(self.devices) > 1 else ''
+            # Nobody waits on OPT3001 readings, so only the latest ones are kept
+            self.queues[device] = { 
+                'AS7262'  : BoundedQueue(prefix + 'AS7262', sizes['AS7262'], options['overflow'], 
+                                onPause=partial(self.onQueuePause, device), onResume=partial(self.onQueueResume, device)),
+                'OPT3001' : BoundedQueue(prefix + 'OPT3001', sizes['OPT3001']), 
+            }
+        self.stats    = dict( (device, {}) for device in self.devices )
+        self.luxStats = dict( (device, None) for device in self.devices )
+        self.samples  = dict( (device, SampleStore(capacity=options['max_samples'], spill_dir=options['spill_dir'])) 
+            for device in self.devices )
+        self.running  = set()
+        # Forked now, before any reactor thread is started
+        self.pool     = WorkerPool(options['workers']) if options['workers'] else None
+        self.sweep   = options['sweep'] or []
+        self.step    = 0
+        metrics.enable(options['metrics'])
 
     def startService(self):
         '''
@@ -92,15 +119,21 @@ class AS7262Service(MultiService):
             tw_version=__twisted_version__)
         self.serialService  = self.getServiceNamed(SerialService.NAME)
         self.serialService.setFactory(self.factory) 
-        self.statsService   = self.getServiceNamed(StatsService.NAME)
+        for device in self.devices:
+            self.statsServices[device] = self.getServiceNamed(serviceName(StatsService.NAME, device))
+            self.luxServices[device]   = self.getServiceNamed(serviceName(LuxStatsService.NAME, device))
         self.consoService   = self.getServiceNamed(ConsoleService.NAME)
         self.storageService = self.getServiceNamed(StorageService.NAME)
         try:
             self.storageService.startService()
             self.serialService.startService()
             self.consoService.startService()
-            if self.options['automatic']:
-                reactor.callLater(7,self.onCalibrationStart)
+            if self.sweep:
+                self.setWavelength(self.sweep[0])
+            if self.pool is not None:
+                reactor.addSystemEventTrigger('after', 'shutdown', self.pool.stop)
+            if metrics.enabled and self.options['metrics_file'] is not None:
+                reactor.addSystemEventTrigger('before', 'shutdown', self.onMetricsSave)
         except Exception as e:
             log.failure("{excp!s}", excp=e)
             log.critical("Problems initializing {name}. Exiting gracefully", 
@@ -117,37 +150,117 @@ class AS7262Service(MultiService):
     # Event Handlers from child services
     # ----------------------------------
 
-    def onReading(self, reading, who):
+    def onReading(self, reading, device):
+        '''
+        Enqueues to the proper service of the device.
+        AS7262 readings are only stored once accepted by the statistics
+        service, so that those dropped by the overflow policy are not.
+        '''
+        queue = self.queues[device][reading.type]
+        if metrics.enabled:
+            # A waiting consumer is run synchronously by put(): timed apart
+            stage = 'consume' if queue.waiting else 'enqueue'
+            t0 = metrics.clock()
+        queue.put(reading)
+        if metrics.enabled:
+            metrics.observe(stage, metrics.clock() - t0)
+            metrics.gauge('queue.' + queue.name, len(queue.pending))
+
+    def onSampleAccepted(self, reading, device):
         '''
-        Enqueues to the proper service
+        Stores, logs and streams an AS7262 reading taken from the queue.
+        Returns False if the reading is malformed and must be ignored.
         '''
-        qname = reading['type']
-        self.queue[qname].put(reading)
-        if reading['type'] == 'AS7262':
-            self.samples.append(reading)
+        try:
+            self.samples[device].append(reading)
+        except ValueError as e:
+            log.error("[{device}] discarding malformed reading: {excp!s}", device=device, excp=e)
+            return False
+        self.storageService.onReading(reading, device)
+        return True
 
     def onDeviceReady(self):
         '''
-        Disaplay a prompt
+        Disaplay a prompt or, in automatic mode, start right away
         '''
-        self.consoService.displayPrompt()
+        if self.options['automatic']:
+            self.onCalibrationStart()
+        else:
+            self.consoService.displayPrompt()
 
     def onCalibrationStart(self):
         '''
         Pass it onwards when a new reading is made
         '''
-        self.stats = {}
-        self.samples = []
-        self.statsService.startService()
+        if self.running:
+            self.consoService.writeln("Sorry!, acquisition already running.")
+            return
+        self.running = set(self.devices)
+        for device in self.devices:
+            self.stats[device]    = {}
+            self.luxStats[device] = None
+            self.samples[device].clear()
+            # Discard readings left over from a previous acquisition
+            for q in self.queues[device].values():
+                q.clear()
+        self.storageService.onCalibrationStart()
+        for device in self.devices:
+            self.statsServices[device].startService()
+            self.luxServices[device].startService()
         self.serialService.enableMessages()
 
+    def onCalibrationStop(self):
+        '''
+        Pass it onwards when the operator ends the acquisition
+        '''
+        return defer.DeferredList([ self.statsServices[device].onCalibrationStop() for device in self.devices ])
+
+    def onRollingStats(self, line, device):
+        '''
+        Display running statistics
+        '''
+        if len(self.devices) > 1:
+            line = "{0}: {1}".format(device, line)
+        self.consoService.writeln(line)
+
     def onPhotodiodeInput(self, current):
         '''
         Pass it onwards when a new reading is made
         '''
-        self.statsService.onPhotodiodeInput(current)
+        for device in self.devices:
+            self.statsServices[device].onPhotodiodeInput(current)
         
 
+    def onQueuePause(self, device):
+        '''
+        Readings arrive faster than consumed, stop the device
+        '''
+        self.serialService.disableMessages(device)
+
+    def onQueueResume(self, device):
+        '''
+        Readings consumed, restart the device if still acquiring
+        '''
+        if self.statsServices[device].started:
+            self.serialService.enableMessages(device)
+
+    def onMetricsDisplay(self):
+        '''
+        Show the pipeline counters and stage timings
+        '''
+        for queues in self.queues.values():
+            for q in queues.values():
+                metrics.gauge('queue.' + q.name, len(q.pending))
+        self.consoService.writeln(metrics.report())
+
+    def onMetricsSave(self):
+        '''
+        Dump the pipeline counters and stage timings to a JSON file
+        '''
+        path = self.options['metrics_file'] or 'calas7262-metrics.json'
+        metrics.dump(path)
+        log.info("metrics saved to {file}", file=path)
+
     def onCalibrationQuit(self):
         '''
         Pass it onwards when a new reading is made
@@ -155,30 +268,78 @@ class AS7262Service(MultiService):
         reactor.stop()
 
     @inlineCallbacks
-    def onStatsComplete(self, stats, tables):
-        self.serialService.disableMessages()
-        self.stats.update(stats)   # Merge dictionaries
+    def onStatsComplete(self, device, stats, tables):
+        self.serialService.disableMessages(device)
+        dropped = self.queues[device]['AS7262'].dropped
+        if dropped:
+            log.warn("[{device}] {n} AS7262 readings dropped so far by the {policy} policy", 
+                device=device, n=dropped, policy=self.options['overflow'])
+        self.stats[device].update(stats)   # Merge dictionaries
+        self.luxStats[device], luxTable = self.luxServices[device].finish()
+        if luxTable is not None:
+            tables = tuple(tables) + (luxTable,)
+        if len(self.devices) > 1:
+            self.consoService.writeln("Device {0}:".format(device))
         self.consoService.displayTables(tables)
+        # Wait for the other devices, if any
+        self.running.discard(device)
+        if self.running:
+            return
+        yield self.storageService.onAcquisitionEnd()
         if self.options['automatic']:
-            yield self.onCalibrationSave()
-            self.onCalibrationQuit()
+            saved = yield self.onCalibrationSave()
+            if not saved or not self.sweep:
+                self.onCalibrationQuit()
 
 
     @inlineCallbacks
     def onCalibrationSave(self):
-        if len(self.stats) == 0:
+        if self.running or any(len(stats) == 0 for stats in self.stats.values()):
             self.consoService.writeln("Sorry!, no stats to save.")
-            returnValue(None)
-        if not 'photodiode' in self.stats.keys():
+            returnValue(False)
+        if not all('photodiode' in stats.keys() for stats in self.stats.values()):
             self.consoService.writeln("Enter photodiode current first!")
-            returnValue(None)
-        yield self.storageService.onCalibrationSave(self.stats, self.samples)
+            returnValue(False)
+        yield self.storageService.onCalibrationSave(self.stats, self.samples, self.luxStats)
+        if self.sweep:
+            self.nextStep()
+        returnValue(True)
            
 
     # ----------------------
     # Other Helper functions
     # ----------------------
 
+    def setWavelength(self, wavelength):
+        log.info("Sweep step {i}/{n}: wavelength = {w} nm", i=self.step+1, n=len(self.sweep), w=wavelength)
+        for device in self.devices:
+            self.statsServices[device].setWavelength(wavelength)
+            self.luxServices[device].setWavelength(wavelength)
+        self.storageService.setWavelength(wavelength)
+
+    def nextStep(self):
+        '''
+        Advance the wavelength sweep, reusing the already open serial port,
+        QE table and log observers, and wait for the next trigger.
+        '''
+        self.stats = dict( (device, {}) for device in self.devices )
+        self.step += 1
+        if self.step == len(self.sweep):
+            self.consoService.writeln("Sweep finished.")
+            if self.options['automatic']:
+                self.onCalibrationQuit()
+            else:
+                self.consoService.displayPrompt()
+            return
+        wavelength = self.sweep[self.step]
+        self.setWavelength(wavelength)
+        if self.options['automatic']:
+            self.consoService.writeln("Next wavelength {0} nm in {1} seconds".format(wavelength, self.options['sweep_delay']))
+            reactor.callLater(self.options['sweep_delay'], self.onCalibrationStart)
+        else:
+            self.consoService.writeln("Set the monochromator to {0} nm and type start".format(wavelength))
+            self.consoService.displayPrompt()
+
         
 
 __all__ = [ "AS7262Service" ]
\ No newline at end of file
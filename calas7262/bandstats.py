@@ -0,0 +1,245 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import math
+
+from collections import deque
+
+# -------------
+# Other modules
+# -------------
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# ---------------
+# Twisted imports
+# ---------------
+
+#--------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+# Default percentiles computed besides the median
+PERCENTILES = (5, 25, 75, 95)
+
+NAN = float('nan')
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# -------
+# Classes
+# -------
+
+class Welford(object):
+    '''
+    Streaming (online) mean and variance accumulator, in O(1) memory.
+    Also keeps track of the extremes.
+    '''
+
+    __slots__ = ('n', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.n    = 0
+        self.mean = 0.0
+        self.m2   = 0.0
+        self.min  = None
+        self.max  = None
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+
+    @property
+    def variance(self):
+        '''Sample variance (N-1), NaN with less than 2 values'''
+        return self.m2 / (self.n - 1) if self.n > 1 else NAN
+
+    @property
+    def stdev(self):
+        return math.sqrt(self.variance)
+
+    def summary(self):
+        '''Same layout as summarize() entries. Order statistics are not available'''
+        return {
+            'n'      : self.n,
+            'mean'   : self.mean,
+            'stdev'  : self.stdev,
+            'median' : None,
+            'min'    : self.min,
+            'max'    : self.max,
+        }
+
+
+class SlidingWindow(object):
+    '''
+    Running mean and variance over the last size values,
+    updated in O(1) per value by adding the new value and
+    removing the one falling out of the window.
+    Accumulated rounding errors are cleared by recomputing from
+    the window contents once every size removals (amortised O(1)).
+    '''
+
+    __slots__ = ('values', 'n', 'mean', 'm2', 'removed')
+
+    def __init__(self, size):
+        self.values  = deque([], size)
+        self.n       = 0
+        self.mean    = 0.0
+        self.m2      = 0.0
+        self.removed = 0
+
+    def add(self, x):
+        values = self.values
+        if len(values) == values.maxlen:
+            self._remove(values[0])
+        values.append(x)
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        if self.removed >= values.maxlen:
+            self._resync()
+
+    def _remove(self, y):
+        if self.n == 1:
+            self.n, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        self.removed += 1
+        old = self.mean
+        self.n -= 1
+        self.mean = (old * (self.n + 1) - y) / self.n
+        # Clamp rounding errors
+        self.m2 = max(0.0, self.m2 - (y - old) * (y - self.mean))
+
+    def _resync(self):
+        self.removed = 0
+        self.mean = math.fsum(self.values) / self.n
+        self.m2 = math.fsum((x - self.mean)**2 for x in self.values)
+
+    @property
+    def variance(self):
+        '''Sample variance (N-1), NaN with less than 2 values'''
+        return self.m2 / (self.n - 1) if self.n > 1 else NAN
+
+    @property
+    def stdev(self):
+        return math.sqrt(self.variance)
+
+# ----------------
+# Module functions
+# ----------------
+
+def summarize(keys, columns, percentiles=PERCENTILES, use_numpy=None):
+    '''
+    Computes summary statistics for several bands at once.
+    columns is a sequence of equally sized sequences (i.e. a 2-D array,
+    one row per band, in keys order).
+    Returns a dictionary, keyed by band, of dictionaries with
+    'n', 'mean', 'stdev', 'median', 'min', 'max' and 'p<N>' entries.
+    Standard deviation is the sample one (N-1), NaN with less than 2 values.
+    NumPy is used if available, unless use_numpy is False.
+    '''
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    if use_numpy:
+        return _summarize_numpy(keys, columns, percentiles)
+    return _summarize_python(keys, columns, percentiles)
+
+
+def _summarize_numpy(keys, columns, percentiles):
+    data = numpy.vstack([numpy.asarray(column, dtype=numpy.float64) for column in columns])
+    n = data.shape[1]
+    qs = numpy.percentile(data, [50] + list(percentiles), axis=1)
+    mean = data.mean(axis=1)
+    if n > 1:
+        stdev = data.std(axis=1, ddof=1)
+    else:
+        stdev = numpy.full(len(keys), NAN)
+    minimum = data.min(axis=1)
+    maximum = data.max(axis=1)
+    result = {}
+    for i, key in enumerate(keys):
+        entry = {
+            'n'      : n,
+            'mean'   : float(mean[i]),
+            'stdev'  : float(stdev[i]),
+            'median' : float(qs[0][i]),
+            'min'    : float(minimum[i]),
+            'max'    : float(maximum[i]),
+        }
+        for j, p in enumerate(percentiles, 1):
+            entry['p{0}'.format(p)] = float(qs[j][i])
+        result[key] = entry
+    return result
+
+
+def _summarize_python(keys, columns, percentiles):
+    result = {}
+    for key, column in zip(keys, columns):
+        # Single pass for mean, variance (Welford) and extremes
+        n, mean, m2 = 0, 0.0, 0.0
+        minimum = maximum = None
+        for x in column:
+            n += 1
+            delta = x - mean
+            mean += delta / n
+            m2 += delta * (x - mean)
+            if minimum is None or x < minimum:
+                minimum = x
+            if maximum is None or x > maximum:
+                maximum = x
+        ordered = sorted(column)
+        entry = {
+            'n'      : n,
+            'mean'   : mean,
+            'stdev'  : math.sqrt(m2 / (n - 1)) if n > 1 else NAN,
+            'median' : _percentile(ordered, 50),
+            'min'    : minimum,
+            'max'    : maximum,
+        }
+        for p in percentiles:
+            entry['p{0}'.format(p)] = _percentile(ordered, p)
+        result[key] = entry
+    return result
+
+
+def _percentile(ordered, p):
+    '''Linear interpolation between closest ranks, as numpy.percentile()'''
+    if not ordered:
+        return NAN
+    rank = (len(ordered) - 1) * p / 100
+    lo = int(math.floor(rank))
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (rank - lo)
+
+
+__all__ = [
+    "PERCENTILES",
+    "Welford",
+    "SlidingWindow",
+    "summarize",
+]
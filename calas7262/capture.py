@@ -0,0 +1,165 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import time
+import struct
+
+# ---------------
+# Twisted imports
+# ---------------
+
+#--------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+MAGIC          = b'CAL7262C'
+SCHEMA_VERSION = 2
+
+# Version 1 captures have no session records, but are otherwise the same
+VERSIONS = [1, SCHEMA_VERSION]
+
+# File header: magic, version, wall clock time and monotonic time at start
+HEADER = struct.Struct('<8sHdd')
+
+# Record header: monotonic receive time, number of raw bytes that follow
+RECORD = struct.Struct('<dI')
+
+# Record length marking a new session appended to an existing capture,
+# with the monotonic time at its start and no raw bytes
+SESSION = 0xFFFFFFFF
+
+# Pending bytes that trigger a write, besides the periodic flush
+THRESHOLD = 64*1024
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# Python 2 has no monotonic clock
+monotonic = getattr(time, 'monotonic', time.time)
+
+# ----------
+# Exceptions
+# ----------
+
+class CaptureError(ValueError):
+    '''Not a capture file or incompatible version'''
+    def __str__(self):
+        s = self.__doc__
+        if self.args:
+            s = "{0}: '{1}'".format(s, self.args[0])
+        s = '{0}.'.format(s)
+        return s
+
+# ----------------
+# Module functions
+# ----------------
+
+def isCapture(path):
+    '''True if the file is a binary capture'''
+    with open(path, mode='rb') as fd:
+        return fd.read(len(MAGIC)) == MAGIC
+
+
+def readCapture(path):
+    '''
+    Iterates over a binary capture, yielding (monotonic timestamp, raw bytes)
+    tuples as received from the serial port. Monotonic clocks of different
+    sessions are unrelated, so the timestamps of every appended session are
+    re-based to go on from the last one of the previous session.
+    A truncated last record (i.e. after a crash) is ignored.
+    '''
+    with open(path, mode='rb') as fd:
+        header = fd.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise CaptureError(path)
+        magic, version, _, start = HEADER.unpack(header)
+        if magic != MAGIC or version not in VERSIONS:
+            raise CaptureError(path)
+        offset = 0
+        last   = start
+        while True:
+            head = fd.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            tstamp, length = RECORD.unpack(head)
+            if length == SESSION:
+                offset = last - tstamp
+                continue
+            data = fd.read(length)
+            if len(data) < length:
+                return
+            last = tstamp + offset
+            yield last, data
+
+# -------
+# Classes
+# -------
+
+class CaptureWriter(object):
+    '''
+    Records raw serial data with monotonic receive timestamps.
+    Records are batched in memory and written in a single call
+    either by flush() or when THRESHOLD bytes are pending.
+    Opening an existing capture appends a new session to it.
+    '''
+
+    def __init__(self, path):
+        self.path    = path
+        self.fd      = None
+        self.pending = []
+        self.size    = 0
+        self.records = 0
+
+    def open(self):
+        self.fd = open(self.path, mode='ab')
+        if self.fd.tell() == 0:
+            self.fd.write(HEADER.pack(MAGIC, SCHEMA_VERSION, time.time(), monotonic()))
+        elif not isCapture(self.path):
+            self.fd.close()
+            raise CaptureError(self.path)
+        else:
+            self.fd.write(RECORD.pack(monotonic(), SESSION))
+
+    def record(self, data):
+        '''Appends a chunk of raw bytes, timestamped now'''
+        self.pending.append(RECORD.pack(monotonic(), len(data)))
+        self.pending.append(data)
+        self.size += RECORD.size + len(data)
+        self.records += 1
+        if self.size >= THRESHOLD:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.fd.write(b''.join(self.pending))
+            self.fd.flush()
+            self.pending = []
+            self.size = 0
+
+    def close(self):
+        if self.fd is not None:
+            self.flush()
+            self.fd.close()
+            self.fd = None
+
+
+__all__ = [
+    "CaptureError",
+    "CaptureWriter",
+    "isCapture",
+    "readCapture",
+]
@@ -23,14 +23,12 @@ import ConfigParser
 # Twisted imports
 # ---------------
 
-from twisted.logger import LogLevel
-
 #--------------
 # local imports
 # -------------
 
 from calas7262       import __version__
-from calas7262.utils import chop
+from calas7262.utils import chop, deviceIds
 
 # ----------------
 # Module constants
@@ -60,17 +58,50 @@ def cmdline():
     parser.add_argument('--log-file', type=str, default="calas7262.log", help='log file')
     parser.add_argument('--log-messages', action='store_true', help='log raw messages too')
     parser.add_argument('-s' , '--size',    type=int, default=5 , help='how many samples to take before computing statistics')
-    parser.add_argument('-w' , '--wavelength', type=int, required=True, help='enter wavelength for CSV logging')
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('-w' , '--wavelength', type=int, help='enter wavelength for CSV logging')
+    group.add_argument('--sweep', type=int, nargs='+', metavar='WAVELENGTH', help='calibrate several wavelengths in a row')
+    group.add_argument('--sweep-range', type=int, nargs=3, metavar=('START','STOP','STEP'), help='calibrate wavelengths START to STOP (inclusive) in STEP nm')
     parser.add_argument('-d' , '--photodiode', type=float,  help='enter photodiode current for CSV logging')
     parser.add_argument('-l' , '--log-level', type=str, default="info", choices=["info","debug"], help='enter wavelength for CSV logging')
     parser.add_argument('-c' , '--csv-file', type=str, default="calas7262.csv", help='statistics CSV file')
     parser.add_argument('-m' , '--csv-samples', type=str, default="samples.csv", help='CSV samples file')
-    parser.add_argument('-p' , '--port', type=str, default="/dev/ttyUSB0", help='Serial Port path')
+    parser.add_argument('--stream-samples', action='store_true', help='append every sample to the CSV samples file as it arrives, instead of on save')
+    parser.add_argument('--csv-lux', type=str, default="lux.csv", help='OPT3001 statistics CSV file')
+    parser.add_argument('--qe-file', type=str, default=None, help='photodiode QE curve CSV file (WL,QE columns), the reference photodiode one by default')
+    parser.add_argument('--qe-interpolation', type=str, default='linear', choices=['linear', 'spline'], help='QE interpolation between the curve points')
+    parser.add_argument('--sample-log', type=str, default=None, help='binary log file to record every sample')
+    parser.add_argument('-p' , '--port', type=str, nargs='+', default=["/dev/ttyUSB0"], help='Serial Port path(s), one per device calibrated at once')
     parser.add_argument('-b' , '--baud', type=int, default=115200, choices=[9600, 115200], help='Serial port baudrate')
+    parser.add_argument('--capture', type=str, default=None, help='record raw serial data with timestamps to this binary capture file')
+    parser.add_argument('--replay', type=str, nargs='+', default=None, help='replay recorded capture file(s) instead of using the serial port(s)')
+    parser.add_argument('--replay-speed', type=str, default='1', help='replay speed factor over the original timing, or max')
     parser.add_argument('-a', '--automatic', action='store_true', help='Automatic adquisition, save and exit.')
+    parser.add_argument('--sweep-delay', type=float, default=10.0, help='seconds between sweep steps in automatic mode')
+    parser.add_argument('--streaming', action='store_true', help='compute statistics on the fly, without keeping the samples window')
+    parser.add_argument('--rolling', action='store_true', help='display running statistics over a sliding window of --size samples, until stop')
+    parser.add_argument('--refresh', type=float, default=1.0, help='running statistics display period (seconds)')
+    parser.add_argument('--tolerance', type=float, default=None, help='stop as soon as the relative std. error of all bands is below this value, instead of after --size samples')
+    parser.add_argument('--min-size', type=int, default=10, help='min. samples to take with --tolerance')
+    parser.add_argument('--max-size', type=int, default=1000, help='max. samples to take with --tolerance')
+    parser.add_argument('--max-samples', type=int, default=None, help='max. samples held in memory')
+    parser.add_argument('--queue-size', type=int, default=None, help='max. AS7262 readings waiting for the statistics service')
+    parser.add_argument('--overflow', type=str, default='drop-oldest', choices=['drop-oldest', 'drop-newest', 'pause'], help='what to do when the readings queue is full')
+    parser.add_argument('--metrics', action='store_true', help='collect pipeline counters and stage timings')
+    parser.add_argument('--metrics-file', type=str, default=None, help='dump metrics to this JSON file at exit')
+    parser.add_argument('--workers', type=int, default=0, help='worker processes computing statistics and tables of several devices in parallel (0: none)')
+    parser.add_argument('--spill-dir', type=str, default=None, help='spill samples beyond --max-samples to a scratch file in this directory')
 
     
-    return parser.parse_args()
+    opts = parser.parse_args()
+    if opts.sweep_range is not None:
+        start, stop, step = opts.sweep_range
+        if step == 0:
+            parser.error("sweep step must not be zero")
+        opts.sweep = list(range(start, stop + (1 if step > 0 else -1), step))
+        if not opts.sweep:
+            parser.error("empty sweep range, the step sign must match the direction from START to STOP")
+    return opts
 
 def cmdline_options():
     '''
@@ -78,23 +109,57 @@ def cmdline_options():
     '''
    
     opts  = cmdline()
+    if opts.sweep:
+        opts.wavelength = opts.sweep[0]
     
     options = {}
+    # One device id per serial port or replayed capture
+    devices = deviceIds(opts.replay if opts.replay is not None else opts.port)
+
     options['as7262'] = {}
+    options['as7262']['devices']   = devices
     options['as7262']['log_level'] = opts.log_level
     options['as7262']['automatic'] = opts.automatic
+    options['as7262']['workers']   = opts.workers
+    options['as7262']['sweep']       = opts.sweep
+    options['as7262']['sweep_delay'] = opts.sweep_delay
+    window = opts.size if opts.tolerance is None else opts.max_size
+    options['as7262']['max_samples'] = opts.max_samples if opts.max_samples is None or opts.streaming else max(opts.max_samples, window)
+    if opts.stream_samples and opts.max_samples is None:
+        # Samples are on disk already, only the statistics window is kept in memory
+        options['as7262']['max_samples'] = 1 if opts.streaming else window
+    options['as7262']['spill_dir']   = opts.spill_dir
+    options['as7262']['queue_size']   = opts.queue_size
+    options['as7262']['overflow']     = opts.overflow
+    options['as7262']['metrics']      = opts.metrics
+    options['as7262']['metrics_file'] = opts.metrics_file
 
     options['serial'] = {}
-    options['serial']['endpoint']      = "serial:" + opts.port + ":" + str(opts.baud)
+    if opts.replay is not None:
+        options['serial']['endpoints'] = [ "replay:" + path + ":" + opts.replay_speed for path in opts.replay ]
+    else:
+        options['serial']['endpoints'] = [ "serial:" + port + ":" + str(opts.baud) for port in opts.port ]
+    options['serial']['devices']       = devices
     options['serial']['log_level']     = opts.log_level
     options['serial']['log_messages']  = opts.log_messages
+    options['serial']['capture']       = opts.capture
 
     options['stats'] = {}
     options['stats']['log_level']   = opts.log_level
     options['stats']['size']        = opts.size
+    options['stats']['streaming']   = opts.streaming
+    options['stats']['rolling']     = opts.rolling
+    options['stats']['refresh']     = opts.refresh
+    options['stats']['tolerance']   = opts.tolerance
+    options['stats']['min_size']    = max(2, opts.min_size)
+    options['stats']['max_size']    = opts.max_size
     options['stats']['wavelength']  = opts.wavelength
     options['stats']['photodiode']  = opts.photodiode
 
+    options['lux'] = {}
+    options['lux']['log_level']   = opts.log_level
+    options['lux']['wavelength']  = opts.wavelength
+
     options['console'] = {}
     options['console']['log_level']   = opts.log_level
 
@@ -103,6 +168,12 @@ def cmdline_options():
     options['storage']['photodiode']  = opts.photodiode
     options['storage']['csv_file']    = opts.csv_file
     options['storage']['csv_samples'] = opts.csv_samples
+    options['storage']['csv_lux']     = opts.csv_lux
+    options['storage']['stream_samples'] = opts.stream_samples
+    options['storage']['sample_log']  = opts.sample_log
+    options['storage']['qe_file']     = opts.qe_file
+    options['storage']['qe_method']   = opts.qe_interpolation
+    options['storage']['devices']     = devices
     options['storage']['log_level']   = opts.log_level
    
     return options, opts
@@ -122,11 +193,17 @@ def loadCfgFile(path):
     #parser.optionxform = str
     parser.read(path)
 
+    # Comma separated endpoints, one device id per serial port or replayed capture
+    endpoints = chop(parser.get("serial","endpoint"), sep=',')
+    devices   = deviceIds([ chop(endpoint, sep=':')[1] for endpoint in endpoints ])
+
     options['as7262'] = {}
+    options['as7262']['devices']   = devices
     options['as7262']['log_level']  = parser.get("as7262","log_level")
    
     options['serial'] = {}
-    options['serial']['endpoint']      = parser.get("serial","endpoint")
+    options['serial']['endpoints']     = endpoints
+    options['serial']['devices']       = devices
     options['serial']['log_level']     = parser.get("serial","log_level")
 
     options['stats'] = {}
@@ -138,6 +215,7 @@ def loadCfgFile(path):
     options['storage'] = {}
     options['storage']['csv_file']   = parser.get("storage","csv_file")
     options['storage']['csv_samples'] = parser.get("storage","csv_samples")
+    options['storage']['devices']     = devices
     options['storage']['log_level']   = parser.get("storage","log_level")
    
     return options
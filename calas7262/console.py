@@ -44,6 +44,12 @@ COMMANDS = {
             'syntax' : r'^start',
             'callbacks' : set()       
         },
+    'stop':
+        {
+            'help' : 'stop recording and compute statistics',
+            'syntax' : r'^stop',
+            'callbacks' : set()       
+        },
     'quit':
         {
             'help' : 'exit program',
@@ -62,6 +68,12 @@ COMMANDS = {
             'syntax' : r'^save',
             'callbacks' : set()        
         },
+    'metrics':
+        {
+            'help' : 'display pipeline counters and timings (metrics save: dump them to file)',
+            'syntax' : r'^metrics(\s+save)?',
+            'callbacks' : set()        
+        },
     'help':
         {
             'help' : 'display available commands',
@@ -138,10 +150,12 @@ class ConsoleService(Service):
         log.info("starting Console Service")
         self.stdio = stdio.StandardIO(self.protocol)
         self.protocol.addCallback('start', self.calibrationStart)
+        self.protocol.addCallback('stop', self.calibrationStop)
         self.protocol.addCallback('quit', self.calibrationQuit)
         self.protocol.addCallback('photodiode', self.calibrationPhotodiode)
         self.protocol.addCallback('help', self.displayHelp)
         self.protocol.addCallback('save', self.calibrationSave)
+        self.protocol.addCallback('metrics', self.displayMetrics)
         self.protocol.addCallback('<CR>', self.calibrationCR)
           
 
@@ -178,6 +192,13 @@ class ConsoleService(Service):
         self.parent.onCalibrationStart()
 
 
+    def calibrationStop(self, *args):
+        '''
+        Pass it onwards when a new reading is made
+        '''
+        self.parent.onCalibrationStop()
+
+
     def calibrationQuit(self, *args):
         '''
         Pass it onwards when a new reading is made
@@ -196,6 +217,16 @@ class ConsoleService(Service):
         '''
         self.parent.onCalibrationSave()
       
+    def displayMetrics(self, *args):
+        '''
+        Show pipeline metrics or save them to a file
+        '''
+        if args[0]:
+            self.parent.onMetricsSave()
+        else:
+            self.parent.onMetricsDisplay()
+        self.displayPrompt()
+
     def calibrationCR(self, *args):
         '''
         Pass it onwards when a new reading is made
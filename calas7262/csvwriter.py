@@ -0,0 +1,209 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import os
+import csv
+import time
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.logger           import Logger
+from twisted.internet         import reactor
+from twisted.internet.defer   import Deferred
+from twisted.python.failure   import Failure
+
+#--------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+# Pending batches before write() blocks the caller
+MAX_BATCHES = 1024
+
+# Rows written to a file before it is flushed
+FLUSH_ROWS = 4096
+
+# Max. seconds rows stay in user space buffers
+FLUSH_INTERVAL = 1.0
+
+# Request types
+_ROWS  = 0
+_FLUSH = 1
+_STOP  = 2
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+log = Logger(namespace='storag')
+
+# -------
+# Classes
+# -------
+
+class CSVWriter(object):
+    '''
+    Long-lived background thread appending rows to semicolon separated
+    CSV files. Files are opened on first use and kept open; rows are
+    batched and files flushed every FLUSH_ROWS rows or FLUSH_INTERVAL
+    seconds. The request queue is bounded, so a stalled disk eventually
+    blocks the producer instead of exhausting memory.
+
+    flush() and stop() return Deferreds fired in the reactor thread once
+    every previously queued row is written (and fsync'ed if requested).
+    '''
+
+    def __init__(self, max_batches=MAX_BATCHES, flush_rows=FLUSH_ROWS, flush_interval=FLUSH_INTERVAL, clock=reactor):
+        self.queue          = queue.Queue(max_batches)
+        self.flush_rows     = flush_rows
+        self.flush_interval = flush_interval
+        self.clock          = clock
+        self.files          = {}     # path -> [file object, csv writer, unflushed rows]
+        self.thread         = None
+        self.rows           = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='CSVWriter')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, path, rows, header=None):
+        '''
+        Queues rows (a list of sequences) to be appended to path. The header row is written
+        first if the file is empty.
+        '''
+        self.queue.put((_ROWS, path, (header, (rows,))))
+
+    def writeBatches(self, path, batches, header=None):
+        '''
+        Same as write(), with an iterable of row lists
+        (i.e. a generator formatting rows in batches)
+        '''
+        self.queue.put((_ROWS, path, (header, batches)))
+
+    def flush(self, path=None, sync=False):
+        '''
+        Flushes one or all files, fsync'ing them if requested.
+        Returns a Deferred.
+        '''
+        d = Deferred()
+        self.queue.put((_FLUSH, path, (sync, d)))
+        return d
+
+    def stop(self):
+        '''
+        Writes every pending row, closes the files and ends the thread.
+        Returns a Deferred.
+        '''
+        d = Deferred()
+        if self.thread is None or not self.thread.is_alive():
+            d.callback(None)
+        else:
+            self.queue.put((_STOP, None, (True, d)))
+        return d
+
+    # --------------
+    # Writer thread
+    # --------------
+
+    def _run(self):
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.time())
+            try:
+                kind, path, args = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                self._guard(self._flushAll, False)
+                deadline = None
+                continue
+            if kind == _ROWS:
+                self._guard(self._write, path, *args)
+                if deadline is None:
+                    deadline = time.time() + self.flush_interval
+            else:
+                sync, d = args
+                try:
+                    if path is None:
+                        self._flushAll(sync)
+                    else:
+                        self._flush(path, sync)
+                    if kind == _STOP:
+                        self._closeAll()
+                except Exception:
+                    self.clock.callFromThread(d.errback, Failure())
+                else:
+                    self.clock.callFromThread(d.callback, path)
+                if kind == _STOP:
+                    return
+                if path is None:
+                    deadline = None
+
+    def _guard(self, func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            self.clock.callFromThread(log.failure, "CSV writer: {excp!s}", Failure(), excp=e)
+
+    def _open(self, path, header):
+        entry = self.files.get(path)
+        if entry is None:
+            fd = open(path, mode='a')
+            entry = self.files[path] = [fd, csv.writer(fd, delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL), 0]
+            if header is not None and os.fstat(fd.fileno()).st_size == 0:
+                entry[1].writerow(header)
+        return entry
+
+    def _write(self, path, header, batches):
+        entry = self._open(path, header)
+        n = 0
+        writerows = entry[1].writerows
+        for rows in batches:
+            writerows(rows)
+            n += len(rows)
+        entry[2] += n
+        self.rows += n
+        if entry[2] >= self.flush_rows:
+            entry[0].flush()
+            entry[2] = 0
+
+    def _flush(self, path, sync):
+        entry = self.files.get(path)
+        if entry is not None:
+            entry[0].flush()
+            entry[2] = 0
+            if sync:
+                os.fsync(entry[0].fileno())
+
+    def _flushAll(self, sync):
+        for path in self.files:
+            self._flush(path, sync)
+
+    def _closeAll(self):
+        for fd, _, _ in self.files.values():
+            fd.close()
+        self.files = {}
+
+
+__all__ = [
+    "CSVWriter",
+]
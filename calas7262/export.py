@@ -0,0 +1,128 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+'''
+Bulk formatting of samples CSV rows.
+
+Timestamps are rounded to the second, so consecutive samples mostly
+share the same string, which is formatted only once. Rows are built
+a batch at a time as tuples, by zipping the sample store columns with
+the constant (wavelength, current, QE, type) columns.
+'''
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import csv
+import time
+
+from itertools import repeat
+
+#--------------
+# local imports
+# -------------
+
+from calas7262.frame   import AS7262_KEYS
+from calas7262.samples import CONVERTERS
+
+# ----------------
+# Module constants
+# ----------------
+
+TSTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+SAMPLES_HEADER = ['tstamp', 'wavelength', 'current', 'quantum_eff'] + AS7262_KEYS
+
+# Rows formatted at once
+BATCH = 8192
+
+NFIELDS = len(AS7262_KEYS)
+
+# -------
+# Classes
+# -------
+
+class TimestampCache(object):
+    '''
+    Formats POSIX timestamps rounded to the nearest second,
+    remembering the last formatted second
+    '''
+
+    __slots__ = ('second', 'text')
+
+    def __init__(self):
+        self.second = None
+        self.text   = None
+
+    def __call__(self, tstamp):
+        second = int(tstamp + 0.5)
+        if second != self.second:
+            self.second = second
+            self.text   = time.strftime(TSTAMP_FORMAT, time.gmtime(second))
+        return self.text
+
+    def format(self, tstamps):
+        '''Returns the list of formatted strings for a sequence of timestamps'''
+        result = []
+        append = result.append
+        last, text = self.second, self.text
+        for tstamp in tstamps:
+            second = int(tstamp + 0.5)
+            if second != last:
+                last = second
+                text = time.strftime(TSTAMP_FORMAT, time.gmtime(second))
+            append(text)
+        self.second, self.text = last, text
+        return result
+
+# ----------------
+# Module functions
+# ----------------
+
+def sampleRow(sample, meta, stamp=TimestampCache()):
+    '''
+    Samples CSV row for a single AS7262Reading:
+    timestamp, (wavelength, current, QE) metadata and AS7262 fields,
+    converted as in the SampleStore so that both export paths agree
+    '''
+    return (stamp(sample.tstamp),) + meta + ('AS7262',) + tuple(convert(value) 
+        for convert, value in zip(CONVERTERS, sample[1:NFIELDS]))
+
+
+def sampleBatches(samples, meta, size=BATCH):
+    '''
+    Iterates over the samples CSV rows of a SampleStore,
+    as lists of at most size tuples
+    '''
+    stamp    = TimestampCache()
+    constant = [ repeat(value) for value in tuple(meta) + ('AS7262',) ]
+    for columns in samples.batches(size):
+        # Store columns are AS7262_KEYS[1:] followed by tstamp
+        yield list(zip(stamp.format(columns[-1]), *(constant + columns[:-1])))
+
+
+def exportSamples(fd, samples, meta, header=True):
+    '''Writes all samples of a SampleStore to an open file, returns the row count'''
+    writer = csv.writer(fd, delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+    if header:
+        writer.writerow(SAMPLES_HEADER)
+    n = 0
+    for batch in sampleBatches(samples, meta):
+        writer.writerows(batch)
+        n += len(batch)
+    return n
+
+
+__all__ = [
+    "SAMPLES_HEADER",
+    "TimestampCache",
+    "sampleRow",
+    "sampleBatches",
+    "exportSamples",
+]
@@ -0,0 +1,115 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import json
+
+from collections import namedtuple
+
+# ---------------
+# Twisted imports
+# ---------------
+
+#--------------
+# local imports
+# -------------
+
+
+# ----------------
+# Module constants
+# ----------------
+
+# Order in which the different band readings arrive
+COLOUR_KEYS  = ["violet","raw_violet","blue","raw_blue","green","raw_green","yellow","raw_yellow","orange","raw_orange","red","raw_red"]
+AS7262_KEYS  = ["type","seq","millis","accum","exptime","gain","temp"] + COLOUR_KEYS
+OPT3001_KEYS = ["type","seq","millis","accum","exptime","lux"]
+
+# Compact, immutable reading records. Timestamps are UTC POSIX seconds (float)
+AS7262Reading  = namedtuple('AS7262Reading',  AS7262_KEYS  + ['tstamp'])
+OPT3001Reading = namedtuple('OPT3001Reading', OPT3001_KEYS + ['tstamp'])
+
+READINGS = {
+    'AS7262'  : AS7262Reading,
+    'OPT3001' : OPT3001Reading,
+}
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# The C accelerated JSON scanner, without the json.loads() wrapper
+# (whitespace skipping, end of document checks, decoder lookups)
+_scan = json.JSONDecoder().scan_once
+
+# ----------------
+# Module functions
+# ----------------
+
+def decode(line):
+    '''
+    Fast path decoder for the fixed shape firmware frames
+        ["A",seq,millis,accum,exptime,gain,temp,violet,raw_violet, ...]
+        ["O",seq,millis,accum,exptime,lux]
+    Returns a list of values in AS7262_KEYS or OPT3001_KEYS order,
+    with the frame type already translated to 'AS7262' or 'OPT3001'.
+    Returns None if the line is not exactly such a frame, so that the
+    caller may fall back to the generic JSON decoder.
+    '''
+    try:
+        text = line.decode('utf-8')
+        values, end = _scan(text, 0)
+    except (ValueError, StopIteration):
+        return None
+    if type(values) is not list or not values or end != len(text):
+        return None
+    if values[0] == "A":
+        if len(values) != len(AS7262_KEYS):
+            return None
+        values[0] = "AS7262"
+    else:
+        if len(values) != len(OPT3001_KEYS):
+            return None
+        values[0] = "OPT3001"
+    return values
+
+
+def decodeJSON(line):
+    '''
+    Generic (slow path) decoder, for lines not understood by decode().
+    Returns a list of values in AS7262_KEYS or OPT3001_KEYS order.
+    Raises ValueError (or UnicodeDecodeError) if the line is not a valid frame.
+    '''
+    contents = json.loads(line.decode('utf-8'))
+    contents[0] = "AS7262" if contents[0] == "A" else "OPT3001"
+    if len(contents) != len(READINGS[contents[0]]._fields) - 1:
+        raise ValueError("Unexpected number of fields in frame")
+    return contents
+
+
+def makeReading(values, tstamp):
+    '''
+    Builds a reading record from a decoded list of values.
+    The values list is consumed in the process.
+    '''
+    values.append(tstamp)
+    return READINGS[values[0]]._make(values)
+
+
+__all__ = [
+    "COLOUR_KEYS",
+    "AS7262_KEYS",
+    "OPT3001_KEYS",
+    "AS7262Reading",
+    "OPT3001Reading",
+    "decode",
+    "decodeJSON",
+    "makeReading",
+]
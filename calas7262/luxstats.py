@@ -0,0 +1,138 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.logger   import Logger, LogLevel
+from twisted.internet import reactor, defer
+from twisted.internet.defer  import inlineCallbacks
+from twisted.application.service  import Service
+
+#--------------
+# local imports
+# -------------
+
+from calas7262.logger     import setLogLevel
+from calas7262.bandstats  import Welford
+
+# ----------------
+# Module constants
+# ----------------
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+log = Logger(namespace='stats')
+
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
+
+
+class LuxStatsService(Service):
+    '''
+    Accumulates OPT3001 illuminance readings while an AS7262 acquisition
+    is running, using the same streaming accumulator as the AS7262 stats.
+    The acquisition length is set by the AS7262 statistics, which call
+    finish() when complete.
+    '''
+
+    # Service name
+    NAME = 'Lux Statistics Service'
+
+
+    def __init__(self, options, device=None):
+        Service.__init__(self)
+        setLogLevel(namespace='stats', levelStr=options['log_level'])
+        self.started     = False
+        self.options     = options
+        self.device      = device
+        self.pending     = None
+        self.accumulator = Welford()
+        self.wavelength  = options['wavelength']
+
+
+    def startService(self):
+        '''
+        Starts Lux Stats service
+        '''
+        log.info("starting Lux Stats Service")
+        Service.startService(self)
+        self.accumulator = Welford()
+        self.started = True
+        reactor.callLater(0, self.accumulate)
+
+    def stopService(self):
+        log.info("stopping Lux Stats Service")
+        self.started = False
+        if self.pending is not None and not self.pending.called:
+            self.pending.cancel()
+        return Service.stopService(self)
+
+    def setWavelength(self, wavelength):
+        self.wavelength = wavelength
+
+    def finish(self):
+        '''
+        Ends the accumulation and returns the statistics entry and table,
+        or (None, None) if no OPT3001 reading was received
+        '''
+        if self.started:
+            self.stopService()
+        accumulator = self.accumulator
+        if accumulator.n == 0:
+            log.warn("[{device}] no OPT3001 readings received", device=self.device)
+            return None, None
+        statsEntry = {
+            'N'          : accumulator.n,
+            'wavelength' : self.wavelength,
+            'lux'        : round(accumulator.mean, 2),
+            'lux stddev' : round(accumulator.stdev, 2) if accumulator.n > 1 else None,
+            'lux min'    : accumulator.min,
+            'lux max'    : accumulator.max,
+        }
+        return statsEntry, self.formatStats(statsEntry)
+
+    # --------------
+    # Main task
+    # ---------------
+
+    @inlineCallbacks
+    def accumulate(self):
+        '''
+        Task driven by deferred readings
+        '''
+        log.debug("starting lux statistics loop")
+        queue = self.parent.queues[self.device]['OPT3001']
+        while self.started:
+            self.pending = queue.get()
+            try:
+                sample = yield self.pending
+            except defer.CancelledError:
+                break
+            self.accumulator.add(sample.lux)
+            log.debug("received OPT3001 sample {n}", n=self.accumulator.n)
+
+    def formatStats(self, statsEntry):
+        import tabulate
+        headers = ["Samples", "Wavelength (nm)", "Average Lux", "Std. Deviation", "Min.", "Max."]
+        row = [statsEntry['N'], statsEntry['wavelength'], statsEntry['lux'], statsEntry['lux stddev'],
+            statsEntry['lux min'], statsEntry['lux max']]
+        return tabulate.tabulate([row], headers=headers, tablefmt='grid')
+
+
+
+__all__ = [ "LuxStatsService" ]
@@ -11,6 +11,16 @@
 
 from __future__ import division, absolute_import
 
+#--------------
+# local imports
+# -------------
+
+from calas7262.config import cmdline_options
+
+# Parse the command line before loading Twisted and the services,
+# so that --help, --version and bad options answer at once
+options, cmd_opts  = cmdline_options()
+
 # ---------------
 # Twisted imports
 # ---------------
@@ -23,8 +33,8 @@ from twisted.application.service import IService
 # -------------
 
 from calas7262             import __version__
-from calas7262.application import application
-from calas7262.logger      import sysLogInfo
+from calas7262.logger      import sysLogInfo, startLogging
+from calas7262.application import makeApplication
 
 # ----------------
 # Module constants
@@ -39,7 +49,17 @@ from calas7262.logger      import sysLogInfo
 # Module Utility Functions
 # ------------------------
 
-sysLogInfo("Starting {0} {1} Linux service".format(IService(application).name, __version__ ))
-IService(application).startService()
-reactor.run()
-sysLogInfo("{0} {1} Linux service stopped".format(IService(application).name, __version__ ))
+def main():
+    '''
+    Runs the application until the reactor stops.
+    Not to be run while this module is being imported: the import lock would
+    be held all along and pickling tasks to the worker processes deadlocks.
+    '''
+    startLogging(console=cmd_opts.console, filepath=cmd_opts.log_file)
+
+    application = makeApplication(options)
+
+    sysLogInfo("Starting {0} {1} Linux service".format(IService(application).name, __version__ ))
+    IService(application).startService()
+    reactor.run()
+    sysLogInfo("{0} {1} Linux service stopped".format(IService(application).name, __version__ ))
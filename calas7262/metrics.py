@@ -0,0 +1,188 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+'''
+Lightweight hot path instrumentation: counters, gauges and duration
+histograms, shared by all services.
+
+Collection is off by default. Callers test the module level 'enabled'
+flag before taking any timestamp, so the disabled cost is one global
+lookup per instrumented call:
+
+    if metrics.enabled:
+        t0 = metrics.clock()
+    ...
+    if metrics.enabled:
+        metrics.observe('decode', metrics.clock() - t0)
+'''
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import time
+import json
+
+#--------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+# Histogram buckets are powers of two microseconds: [0,1), [1,2), [2,4) ... [2**38, inf)
+NBUCKETS = 40
+
+# Percentiles estimated from the histogram buckets
+PERCENTILES = (50, 90, 99)
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+enabled    = False
+counters   = {}
+gauges     = {}
+histograms = {}
+started    = time.time()
+
+# Best available clock for short durations
+clock = getattr(time, 'perf_counter', time.time)
+
+# -------
+# Classes
+# -------
+
+class Histogram(object):
+    '''
+    Fixed memory duration histogram with logarithmic buckets.
+    Percentiles are reported as the upper bound of their bucket.
+    '''
+
+    __slots__ = ('n', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.n       = 0
+        self.total   = 0.0
+        self.min     = None
+        self.max     = None
+        self.buckets = [0] * NBUCKETS
+
+    def add(self, seconds):
+        self.n     += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        self.buckets[min(int(seconds * 1e6).bit_length(), NBUCKETS - 1)] += 1
+
+    def percentile(self, p):
+        '''Upper bound (seconds) of the bucket holding the p-th percentile'''
+        if self.n == 0:
+            return None
+        rank = p * self.n / 100
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min((1 << i) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        entry = {
+            'n'     : self.n,
+            'total' : self.total,
+            'mean'  : self.total / self.n if self.n else None,
+            'min'   : self.min,
+            'max'   : self.max,
+        }
+        for p in PERCENTILES:
+            entry['p{0}'.format(p)] = self.percentile(p)
+        return entry
+
+# ----------------
+# Module functions
+# ----------------
+
+def enable(flag=True):
+    global enabled
+    enabled = flag
+
+
+def reset():
+    global started
+    counters.clear()
+    gauges.clear()
+    histograms.clear()
+    started = time.time()
+
+
+def incr(name, n=1):
+    counters[name] = counters.get(name, 0) + n
+
+
+def gauge(name, value):
+    '''Records the current value of a level (i.e. a queue depth) and its peak'''
+    current, peak = gauges.get(name, (0, 0))
+    gauges[name] = (value, max(peak, value))
+
+
+def observe(name, seconds):
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms[name] = Histogram()
+    histogram.add(seconds)
+
+
+def snapshot():
+    '''Returns all metrics as a JSON serializable dictionary'''
+    return {
+        'enabled'    : enabled,
+        'uptime'     : time.time() - started,
+        'counters'   : dict(counters),
+        'gauges'     : dict( (name, {'current': current, 'peak': peak}) for name, (current, peak) in gauges.items() ),
+        'histograms' : dict( (name, histogram.summary()) for name, histogram in histograms.items() ),
+    }
+
+
+def report():
+    '''Returns the metrics formatted as text tables'''
+    if not enabled:
+        return "Metrics are disabled (use --metrics)"
+    import tabulate     # only needed here, keeps the protocol module light
+    rows = [ [name, value] for name, value in sorted(counters.items()) ]
+    rows.extend( [name, "{0} (peak {1})".format(current, peak)] for name, (current, peak) in sorted(gauges.items()) )
+    table1 = tabulate.tabulate(rows, headers=["Counter", "Value"], tablefmt='grid')
+    rows = []
+    for name, histogram in sorted(histograms.items()):
+        entry = histogram.summary()
+        rows.append([name, entry['n']] + [ round(entry[key] * 1e6, 1) for key in ['mean'] + [ 'p{0}'.format(p) for p in PERCENTILES ] + ['max'] ])
+    headers = ["Stage", "Count", "Mean (us)"] + [ "p{0} (us)".format(p) for p in PERCENTILES ] + ["Max. (us)"]
+    table2 = tabulate.tabulate(rows, headers=headers, tablefmt='grid')
+    return table1 + '\n' + table2
+
+
+def dump(path):
+    '''Writes a metrics snapshot to a JSON file'''
+    with open(path, mode='w') as fd:
+        json.dump(snapshot(), fd, indent=2, sort_keys=True)
+
+
+__all__ = [
+    "clock",
+    "enable",
+    "reset",
+    "incr",
+    "gauge",
+    "observe",
+    "snapshot",
+    "report",
+    "dump",
+]
@@ -11,8 +11,7 @@
 from __future__ import division, absolute_import
 
 import re
-import datetime
-import json
+import time
 
 # ---------------
 # Twisted imports
@@ -27,18 +26,24 @@ from twisted.protocols.basic      import LineOnlyReceiver
 # local imports
 # -------------
 
+from calas7262 import metrics
+from calas7262.frame import COLOUR_KEYS, AS7262_KEYS, OPT3001_KEYS, decode, decodeJSON, makeReading
 
 # ----------------
 # Module constants
 # ----------------
 
+# Readiness states
+BOOTING = 'booting'
+READY   = 'ready'
 
-log = Logger(namespace='proto')
+# Lines of the firmware boot banner
+BANNER_LINES = 6
+
+# Max. seconds to wait for the device to be ready
+READY_TIMEOUT = 7.0
 
-# Order in which the different band readings arrive
-COLOUR_KEYS  = ["violet","raw_violet","blue","raw_blue","green","raw_green","yellow","raw_yellow","orange","raw_orange","red","raw_red"]
-AS7262_KEYS  = ["type","seq","millis","accum","exptime","gain","temp"] + COLOUR_KEYS
-OPT3001_KEYS = ["type","seq","millis","accum","exptime","lux"]
+log = Logger(namespace='proto')
 
 # ----------------
 # Module functions
@@ -85,6 +90,9 @@ class AS7262Protocol(LineOnlyReceiver):
     # So that we can patch it in tests with Clock.callLater ...
     callLater = reactor.callLater
 
+    # Set by the Serial Service when raw lines are to be logged
+    logMessages = False
+
     # -------------------------
     # Twisted Line Receiver API
     # -------------------------
@@ -94,35 +102,56 @@ class AS7262Protocol(LineOnlyReceiver):
         # LineOnlyReceiver.delimiter = b'\n'
         self._onReading     = set()                # callback sets
         self._onDeviceReady = set() 
+        self._onRawData     = set()
+        self.state          = BOOTING
+        self._timeout       = None
 
     def connectionMade(self):
         log.debug("connectionMade()")
         self._error_passes = 0
+        self.state  = BOOTING
+        self._timeout = self.callLater(READY_TIMEOUT, self._ready, "timeout")
 
+    def connectionLost(self, reason):
+        self._cancelTimers()
+
+
+    def dataReceived(self, data):
+        for callback in self._onRawData:
+            callback(data)
+        LineOnlyReceiver.dataReceived(self, data)
 
     def lineReceived(self, line):
-        try:
-            now = datetime.datetime.utcnow()
-            line = line.decode('utf-8')  # from bytearray to string
+        now = time.time()
+        if metrics.enabled:
+            t0 = metrics.clock()
+            metrics.incr('lines')
+        if self.logMessages:
             log.info("raw line => {line}", line=line)
-            contents = json.loads(line)
-        except Exception as e:
-            self._error_passes += 1
-            log.error('#{i}, Invalid JSON in line (ignoring) => {line}', i=self._error_passes, line=line)
-            if self._error_passes == 6:
-                for callback in self._onDeviceReady:
-                    callback()
-        else:
-            contents[0] = "AS7262" if contents[0] == "A" else "OPT3001"
-            if contents[0] == "AS7262":
-                contents = zip(AS7262_KEYS, contents)
-            else:
-                contents = zip(OPT3001_KEYS, contents)
-            contents.append(('tstamp', now))
-            contents = dict(contents)
-            log.debug("decoded {dictionary}", dictionary=contents)
-            for callback in self._onReading:
-                callback(contents)
+        contents = decode(line)
+        if contents is None:
+            try:
+                contents = decodeJSON(line)
+            except Exception as e:
+                self._error_passes += 1
+                if metrics.enabled:
+                    metrics.incr('json_errors')
+                if self.state == BOOTING:
+                    log.info('#{i}, boot banner => {line}', i=self._error_passes, line=line)
+                    self._onBanner()
+                else:
+                    log.error('#{i}, Invalid JSON in line (ignoring) => {line}', i=self._error_passes, line=line)
+                return
+        if self.state == BOOTING:
+            self._ready("first frame")
+        reading = makeReading(contents, now)
+        if metrics.enabled:
+            metrics.observe('decode', metrics.clock() - t0)
+            metrics.incr('frames.' + reading.type)
+        if self.logMessages:
+            log.debug("decoded {reading}", reading=reading)
+        for callback in self._onReading:
+            callback(reading)
 
     def enableMessages(self):
         self.transport.write('x')
@@ -150,10 +179,42 @@ class AS7262Protocol(LineOnlyReceiver):
         '''
         self._onDeviceReady.add(callback)
 
+    def addRawDataCallback(self, callback):
+        '''
+        API Entry Point
+        '''
+        self._onRawData.add(callback)
+
 
     # --------------
     # Helper methods
     # --------------
+
+    def _onBanner(self):
+        '''
+        Ready after the whole banner. A shorter one ends
+        with the first reading or the ready timeout.
+        '''
+        if self._error_passes >= BANNER_LINES:
+            self._ready("boot banner")
+
+    def _cancelTimers(self):
+        if self._timeout is not None and self._timeout.active():
+            self._timeout.cancel()
+        self._timeout = None
+
+    def _ready(self, reason):
+        '''Leaves the booting state, once per connection'''
+        if self.state != BOOTING:
+            return
+        self._cancelTimers()
+        self.state = READY
+        if reason == "timeout":
+            log.warn("device not detected after {t} s, assuming it is ready", t=READY_TIMEOUT)
+        else:
+            log.info("device ready ({reason})", reason=reason)
+        for callback in self._onDeviceReady:
+            callback()
         
         
 #---------------------------------------------------------------------
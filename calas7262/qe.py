@@ -0,0 +1,152 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+'''
+Photodiode quantum efficiency (QE) curves.
+
+A curve is loaded once from a CSV file with 'WL' (nm) and 'QE' columns,
+interpolated (linear or natural cubic spline) and tabulated every
+RESOLUTION nm over its whole range, so that looking up the QE of any
+wavelength in range is O(1).
+'''
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import os.path
+import csv
+import bisect
+
+from array import array
+
+# ---------------
+# Twisted imports
+# ---------------
+
+#--------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+# Curve of the reference photodiode shipped with the package
+DEFAULT_CURVE = os.path.join(os.path.dirname(__file__), 'data', 'QE_photodiode.csv')
+
+LINEAR = 'linear'
+SPLINE = 'spline'
+
+METHODS = [LINEAR, SPLINE]
+
+# Lookup table step (nm)
+RESOLUTION = 1.0
+
+# Decimal digits kept in interpolated values
+DIGITS = 4
+
+# -------
+# Classes
+# -------
+
+class QECurve(object):
+    '''
+    Quantum efficiency as a function of wavelength,
+    from a set of (wavelength, QE) points.
+    Wavelengths out of the points range have no QE
+    (see 'in' and get()).
+    '''
+
+    def __init__(self, wavelengths, values, method=LINEAR, resolution=RESOLUTION):
+        if method not in METHODS:
+            raise ValueError("Unknown QE interpolation method {0}".format(method))
+        if len(wavelengths) < 2:
+            raise ValueError("At least two points are needed for a QE curve")
+        self.method     = method
+        self.resolution = resolution
+        self.x  = array('d', wavelengths)
+        self.y  = array('d', values)
+        self.d2 = splineCoefficients(self.x, self.y) if method == SPLINE else None
+        n = int(round((self.x[-1] - self.x[0]) / resolution)) + 1
+        self.table = array('d', (self.interpolate(self.x[0] + i * resolution) for i in range(n)))
+
+    @classmethod
+    def fromCSV(cls, path=None, method=LINEAR, resolution=RESOLUTION):
+        '''
+        Loads a curve from a CSV file with 'WL' and 'QE' columns.
+        Points are sorted by wavelength and repeated wavelengths ignored.
+        '''
+        points = {}
+        with open(path or DEFAULT_CURVE, mode='r') as csv_file:
+            for row in csv.DictReader(csv_file):
+                points.setdefault(float(row['WL']), float(row['QE']))
+        wavelengths = sorted(points)
+        return cls(wavelengths, [points[w] for w in wavelengths], method, resolution)
+
+    def __contains__(self, wavelength):
+        return self.x[0] <= wavelength <= self.x[-1]
+
+    def __getitem__(self, wavelength):
+        '''QE at a given wavelength, from the lookup table if it falls on its grid'''
+        if not wavelength in self:
+            raise KeyError(wavelength)
+        offset = (wavelength - self.x[0]) / self.resolution
+        i = int(round(offset))
+        if abs(offset - i) < 1e-9:
+            return self.table[i]
+        return self.interpolate(wavelength)
+
+    def get(self, wavelength, default=None):
+        return self[wavelength] if wavelength in self else default
+
+    def interpolate(self, wavelength):
+        '''Interpolated QE at a given wavelength in range'''
+        x, y = self.x, self.y
+        i = max(1, min(bisect.bisect_left(x, wavelength), len(x) - 1))
+        h = x[i] - x[i-1]
+        a = (x[i] - wavelength) / h
+        b = 1 - a
+        value = a * y[i-1] + b * y[i]
+        if self.d2 is not None:
+            d2 = self.d2
+            value += ((a**3 - a) * d2[i-1] + (b**3 - b) * d2[i]) * h * h / 6
+        return round(value, DIGITS)
+
+    def __repr__(self):
+        return "<QECurve {0} points, {1}-{2} nm, {3}>".format(len(self.x), self.x[0], self.x[-1], self.method)
+
+# ----------------
+# Module functions
+# ----------------
+
+def splineCoefficients(x, y):
+    '''
+    Second derivatives of the natural cubic spline through (x, y) points,
+    solving the tridiagonal system with the Thomas algorithm
+    '''
+    n = len(x)
+    d2 = [0.0] * n
+    u  = [0.0] * n
+    for i in range(1, n - 1):
+        sigma = (x[i] - x[i-1]) / (x[i+1] - x[i-1])
+        p = sigma * d2[i-1] + 2.0
+        d2[i] = (sigma - 1.0) / p
+        slope = (y[i+1] - y[i]) / (x[i+1] - x[i]) - (y[i] - y[i-1]) / (x[i] - x[i-1])
+        u[i] = (6.0 * slope / (x[i+1] - x[i-1]) - sigma * u[i-1]) / p
+    d2[-1] = 0.0
+    for i in range(n - 2, -1, -1):
+        d2[i] = d2[i] * d2[i+1] + u[i]
+    return array('d', d2)
+
+
+__all__ = [
+    "DEFAULT_CURVE",
+    "METHODS",
+    "QECurve",
+]
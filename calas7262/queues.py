@@ -0,0 +1,102 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.logger         import Logger
+from twisted.internet.defer import DeferredQueue
+
+#--------------
+# local imports
+# -------------
+
+from calas7262 import metrics
+
+# ----------------
+# Module constants
+# ----------------
+
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+PAUSE       = 'pause'
+
+POLICIES = [DROP_OLDEST, DROP_NEWEST, PAUSE]
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+log = Logger(namespace='as7262')
+
+# -------
+# Classes
+# -------
+
+class BoundedQueue(DeferredQueue):
+    '''
+    DeferredQueue holding at most size pending items, with an overflow policy:
+    - drop-oldest: discard the oldest pending item to make room.
+    - drop-newest: discard the incoming item.
+    - pause: discard the incoming item and call onPause(), then call
+      onResume() once the consumer has drained the queue down to half size.
+    Discarded items are counted in 'dropped'.
+    '''
+
+    def __init__(self, name, size, policy=DROP_OLDEST, onPause=None, onResume=None):
+        if policy not in POLICIES:
+            raise ValueError("Unknown overflow policy {0}".format(policy))
+        DeferredQueue.__init__(self)
+        self.name     = name
+        self.limit    = size
+        self.policy   = policy
+        self.onPause  = onPause
+        self.onResume = onResume
+        self.paused   = False
+        self.dropped  = 0
+
+    def put(self, obj):
+        if self.waiting or len(self.pending) < self.limit:
+            DeferredQueue.put(self, obj)
+            return
+        self.dropped += 1
+        if metrics.enabled:
+            metrics.incr('dropped.' + self.name)
+        if self.policy == DROP_OLDEST:
+            del self.pending[0]
+            self.pending.append(obj)
+        elif self.policy == PAUSE and not self.paused:
+            self.paused = True
+            log.warn("{name} queue full ({n} items), pausing the device", name=self.name, n=self.limit)
+            if self.onPause is not None:
+                self.onPause()
+
+    def get(self):
+        d = DeferredQueue.get(self)
+        if self.paused and len(self.pending) <= self.limit // 2:
+            self.paused = False
+            log.info("{name} queue drained, resuming the device", name=self.name)
+            if self.onResume is not None:
+                self.onResume()
+        return d
+
+    def clear(self):
+        '''Discards pending items, keeping waiting consumers'''
+        del self.pending[:]
+        self.paused = False
+
+
+__all__ = [
+    "BoundedQueue",
+    "POLICIES",
+]
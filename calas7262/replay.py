@@ -0,0 +1,184 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import time
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.logger               import Logger
+from twisted.internet             import reactor
+
+#--------------
+# local imports
+# -------------
+
+from calas7262.frame   import decode
+from calas7262.capture import isCapture, readCapture
+
+# ----------------
+# Module constants
+# ----------------
+
+# Lines delivered per reactor iteration when replaying as fast as possible
+BATCH = 256
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+log = Logger(namespace='serial')
+
+# ----------------
+# Module functions
+# ----------------
+
+def textCapture(path):
+    '''
+    Iterates over a text capture (raw lines as sent by the device),
+    yielding (timestamp, line, is frame) tuples. Frame timestamps are
+    taken from the device millis field; other lines have no timestamp.
+    '''
+    with open(path, mode='rb') as fd:
+        for line in fd:
+            line = line.rstrip(b'\r\n')
+            values = decode(line)
+            yield (values[2] / 1000 if values is not None else None, line, values is not None)
+
+
+def binaryCapture(path):
+    '''
+    Iterates over a binary capture made by CaptureWriter, reassembling
+    the raw chunks into lines and yielding (timestamp, line, is frame)
+    tuples. Line timestamps are the receive times of their last chunk.
+    '''
+    buf = b''
+    for tstamp, data in readCapture(path):
+        buf += data
+        lines = buf.split(b'\n')
+        buf = lines.pop()
+        for line in lines:
+            line = line.rstrip(b'\r')
+            yield (tstamp, line, decode(line) is not None)
+
+
+def openCapture(path):
+    '''Iterates over either a binary or a text capture'''
+    return binaryCapture(path) if isCapture(path) else textCapture(path)
+
+# -------
+# Classes
+# -------
+
+class ReplayTransport(object):
+    '''
+    Minimal serial transport replacement feeding a recorded capture
+    (either a text or a binary one) to a line protocol, either with the
+    original timing (scaled by speed) or as fast as possible (speed None).
+    Leading lines before the first frame (the boot banner) are delivered
+    on connection. Frames are then only delivered while enabled by the
+    protocol ('x' enables, 'z' disables), as the firmware does.
+    '''
+
+    def __init__(self, protocol, path, speed=1.0, clock=reactor):
+        self.protocol  = protocol
+        self.path      = path
+        self.speed     = speed
+        self.clock     = clock
+        self.records   = openCapture(path)
+        self.next      = None
+        self.booting   = True
+        self.paused    = True
+        self.finished  = False
+        self.disconnecting = False
+        self.delayed   = None
+        self.anchor    = None
+        self.nlines    = 0
+        self.protocol.makeConnection(self)
+        self.clock.callLater(0, self._pump)
+
+    # ---------------------------------------
+    # Transport API used by the AS7262Protocol
+    # ---------------------------------------
+
+    def write(self, data):
+        if data in (b'x', 'x'):
+            self.paused = False
+            self.anchor = None
+            self._schedule(0)
+        elif data in (b'z', 'z'):
+            self.paused = True
+
+    def flushOutput(self):
+        pass
+
+    def loseConnection(self):
+        self.disconnecting = True
+        self._finish()
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _schedule(self, delay):
+        if self.delayed is None and not self.finished:
+            self.delayed = self.clock.callLater(delay, self._pump)
+
+    def _finish(self):
+        if not self.finished:
+            self.finished = True
+            self.records.close()
+            log.info("replay of {path} finished after {n} lines", path=self.path, n=self.nlines)
+
+    def _pump(self):
+        self.delayed = None
+        delivered = 0
+        while not self.finished and (self.booting or not self.paused):
+            if self.next is None:
+                self.next = next(self.records, None)
+                if self.next is None:
+                    self._finish()
+                    return
+            tstamp, line, frame = self.next
+            if frame:
+                self.booting = False
+                if self.paused:
+                    return
+                if self.speed is not None and tstamp is not None:
+                    now = time.time()
+                    if self.anchor is None:
+                        self.anchor = (now, tstamp)
+                    due = self.anchor[0] + (tstamp - self.anchor[1]) / self.speed
+                    if due > now:
+                        self._schedule(due - now)
+                        return
+                elif delivered >= BATCH:
+                    # Let the reactor breathe
+                    self._schedule(0)
+                    return
+            self.next = None
+            self.nlines += 1
+            delivered += 1
+            paused = self.paused
+            self.protocol.dataReceived(line + self.protocol.delimiter)
+            if self.paused != paused:
+                # Enabled or disabled by this very line. Go on in a later
+                # iteration, once the consumers it started are running
+                self._schedule(0)
+                return
+
+
+__all__ = [
+    "ReplayTransport",
+    "openCapture",
+]
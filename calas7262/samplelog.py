@@ -0,0 +1,338 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import os
+import os.path
+import csv
+import mmap
+import struct
+
+from array import array
+
+# -------------
+# Other modules
+# -------------
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# ---------------
+# Twisted imports
+# ---------------
+
+#--------------
+# local imports
+# -------------
+
+from calas7262.samples import AS7262_SCHEMA, CONVERTERS
+
+# ----------------
+# Module constants
+# ----------------
+
+MAGIC          = b'CAL7262\x00'
+SCHEMA_VERSION = 2
+
+# Record fields and struct codes (little endian, standard sizes),
+# AS7262 fields typed as in the SampleStore
+FIELDS = [
+    ('tstamp',     'd'),
+    ('wavelength', 'd'),
+] + [ (name, 'q' if code == 'l' else 'd') for name, code in AS7262_SCHEMA if name != 'tstamp' ]
+
+RECORD = struct.Struct('<' + ''.join(code for _, code in FIELDS))
+
+# Same record layout, as a NumPy structured type
+DTYPE = numpy.dtype([ (name, '<f8' if code == 'd' else '<i8') for name, code in FIELDS ]) if numpy is not None else None
+
+# Fixed size file header: magic, schema version, record size, data offset,
+# followed by the schema description "name:code,name:code,..." padded with NULs
+HEADER_SIZE = 512
+HEADER      = struct.Struct('<8sHHI')
+
+# Sidecar index columns, one row per acquisition run
+INDEX_KEYS = ['run', 'wavelength', 'first', 'count', 'start', 'end']
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# ----------
+# Exceptions
+# ----------
+
+class SampleLogError(ValueError):
+    '''Not a sample log file or incompatible schema'''
+    def __str__(self):
+        s = self.__doc__
+        if self.args:
+            s = "{0}: '{1}'".format(s, self.args[0])
+        s = '{0}.'.format(s)
+        return s
+
+# ----------------
+# Module functions
+# ----------------
+
+def indexPath(path):
+    return path + '.idx'
+
+
+def makeHeader():
+    schema = ','.join('{0}:{1}'.format(name, code) for name, code in FIELDS).encode('ascii')
+    header = HEADER.pack(MAGIC, SCHEMA_VERSION, RECORD.size, HEADER_SIZE) + schema
+    return header + b'\x00' * (HEADER_SIZE - len(header))
+
+
+def checkHeader(data, path):
+    '''Validates a file header and returns the data offset'''
+    if len(data) < HEADER.size:
+        raise SampleLogError(path)
+    magic, version, size, offset = HEADER.unpack(data[:HEADER.size])
+    if magic != MAGIC or version != SCHEMA_VERSION or size != RECORD.size:
+        raise SampleLogError(path)
+    return offset
+
+
+def readIndex(path):
+    '''Returns the list of run entries (dictionaries) of a sample log index'''
+    runs = []
+    path = indexPath(path)
+    if not os.path.exists(path):
+        return runs
+    with open(path, mode='r') as index_file:
+        reader = csv.DictReader(index_file, delimiter=';')
+        for row in reader:
+            runs.append({
+                'run'        : int(row['run']),
+                'wavelength' : float(row['wavelength']),
+                'first'      : int(row['first']),
+                'count'      : int(row['count']),
+                'start'      : float(row['start']),
+                'end'        : float(row['end']),
+            })
+    return runs
+
+# -------
+# Classes
+# -------
+
+class SampleLogWriter(object):
+    '''
+    Append-only binary log of AS7262 readings, made of fixed size records,
+    plus a sidecar CSV index with one row per acquisition run
+    (run id, wavelength, first record, record count, start & end timestamps).
+    '''
+
+    def __init__(self, path, buffering=64*1024):
+        self.path       = path
+        self.buffering  = buffering
+        self.fd         = None
+        self.records    = 0
+        self.run        = None
+        self.wavelength = None
+        self.first      = None
+        self.start      = None
+        self.end        = None
+        self.nextRun    = 0
+
+    def open(self):
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, mode='rb') as fd:
+                offset = checkHeader(fd.read(HEADER_SIZE), self.path)
+            size = os.path.getsize(self.path) - offset
+            # Discard any trailing partial record left by a crash
+            self.records = size // RECORD.size
+            self.fd = open(self.path, mode='r+b', buffering=self.buffering)
+            self.fd.truncate(offset + self.records * RECORD.size)
+            self.fd.seek(0, os.SEEK_END)
+        else:
+            self.fd = open(self.path, mode='wb', buffering=self.buffering)
+            self.fd.write(makeHeader())
+            self.records = 0
+        runs = readIndex(self.path)
+        self.nextRun = runs[-1]['run'] + 1 if runs else 0
+
+    def close(self):
+        if self.run is not None:
+            self.endRun()
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
+
+    def startRun(self, wavelength):
+        '''Starts a new acquisition run and returns its id'''
+        if self.run is not None:
+            self.endRun()
+        self.run        = self.nextRun
+        self.nextRun   += 1
+        self.wavelength = wavelength
+        self.first      = self.records
+        self.start      = None
+        self.end        = None
+        return self.run
+
+    def write(self, reading):
+        '''Appends an AS7262Reading to the current run'''
+        values = [ convert(value) for convert, value in zip(CONVERTERS, reading[1:-1]) ]
+        self.fd.write(RECORD.pack(reading.tstamp, self.wavelength, *values))
+        self.records += 1
+        if self.start is None:
+            self.start = reading.tstamp
+        self.end = reading.tstamp
+
+    def endRun(self):
+        '''Closes the current run, flushing records and updating the index'''
+        self.fd.flush()
+        count = self.records - self.first
+        if count > 0:
+            path = indexPath(self.path)
+            writeheader = not os.path.exists(path)
+            with open(path, mode='a') as index_file:
+                writer = csv.writer(index_file, delimiter=';')
+                if writeheader:
+                    writer.writerow(INDEX_KEYS)
+                writer.writerow([self.run, self.wavelength, self.first, count, repr(self.start), repr(self.end)])
+        self.run = None
+
+
+class SampleArchive(object):
+    '''
+    Read only, memory mapped access to a sample log.
+    With NumPy, columns are returned as zero-copy views of the mapped
+    file (they must be released before calling close()).
+    Without NumPy, columns are copied into typed arrays.
+    Runs are located through the sidecar index. Records past the last
+    indexed run (i.e. an interrupted acquisition) form an extra run
+    whose id is None.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.fd   = open(path, mode='rb')
+        self.mm   = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offset  = checkHeader(self.mm[:HEADER.size], path)
+        self.records = (len(self.mm) - self.offset) // RECORD.size
+        self.index   = [ run for run in readIndex(path) if run['first'] + run['count'] <= self.records ]
+        tail = self.index[-1]['first'] + self.index[-1]['count'] if self.index else 0
+        if tail < self.records:
+            first = self._unpack(tail)
+            last  = self._unpack(self.records - 1)
+            self.index.append({
+                'run'        : None,
+                'wavelength' : first[1],
+                'first'      : tail,
+                'count'      : self.records - tail,
+                'start'      : first[0],
+                'end'        : last[0],
+            })
+        if numpy is not None:
+            self.data = numpy.frombuffer(self.mm, dtype=DTYPE, count=self.records, offset=self.offset)
+        else:
+            self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.records
+
+    def close(self):
+        self.data = None
+        self.mm.close()
+        self.fd.close()
+
+    def runs(self, wavelength=None, start=None, end=None):
+        '''
+        Returns the index entries of runs matching a wavelength
+        and overlapping a [start, end] time range (POSIX seconds)
+        '''
+        return [ run for run in self.index if
+            (wavelength is None or run['wavelength'] == wavelength) and
+            (start is None or run['end'] >= start) and
+            (end is None or run['start'] <= end) ]
+
+    def slices(self, wavelength=None, start=None, end=None):
+        '''
+        Returns (first, stop) record ranges matching the filters.
+        Timestamps are increasing within a run, so time bounds are
+        found by bisection.
+        '''
+        result = []
+        for run in self.runs(wavelength, start, end):
+            first, stop = run['first'], run['first'] + run['count']
+            if start is not None and run['start'] < start:
+                first = self._bisect(first, stop, start)
+            if end is not None and run['end'] > end:
+                stop = self._bisect(first, stop, end, right=True)
+            if first < stop:
+                result.append((first, stop))
+        return result
+
+    def column(self, name, wavelength=None, start=None, end=None):
+        '''
+        Returns the values of a column for the matching records.
+        With NumPy, a zero-copy view when they are contiguous.
+        '''
+        i = [ field for field, _ in FIELDS ].index(name)
+        ranges = self.slices(wavelength, start, end)
+        if self.data is not None:
+            views = [ self.data[name][first:stop] for first, stop in ranges ]
+            if len(views) == 1:
+                return views[0]
+            if not views:
+                return self.data[name][0:0]
+            return numpy.concatenate(views)
+        result = array(FIELDS[i][1] if FIELDS[i][1] == 'd' else 'l')
+        for first, stop in ranges:
+            for n in range(first, stop):
+                result.append(self._unpack(n)[i])
+        return result
+
+    def columns(self, names, wavelength=None, start=None, end=None):
+        '''Returns a dictionary of columns, see column()'''
+        return dict( (name, self.column(name, wavelength, start, end)) for name in names )
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _unpack(self, n):
+        return RECORD.unpack_from(self.mm, self.offset + n * RECORD.size)
+
+    def _tstamp(self, n):
+        return struct.unpack_from('<d', self.mm, self.offset + n * RECORD.size)[0]
+
+    def _bisect(self, lo, hi, tstamp, right=False):
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self._tstamp(mid)
+            if value < tstamp or (right and value == tstamp):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+__all__ = [
+    "FIELDS",
+    "RECORD",
+    "SampleLogError",
+    "SampleLogWriter",
+    "SampleArchive",
+    "readIndex",
+]
@@ -0,0 +1,270 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import os
+import struct
+import tempfile
+
+from array import array
+
+# ---------------
+# Twisted imports
+# ---------------
+
+#--------------
+# local imports
+# -------------
+
+from calas7262.frame import COLOUR_KEYS, AS7262Reading
+
+# ----------------
+# Module constants
+# ----------------
+
+# Column name and array typecode, in AS7262Reading order (minus 'type').
+# Fields sent as integers by the firmware are kept integral. The exposure
+# time comes in 2.8 ms steps
+AS7262_SCHEMA = [
+    ('seq',     'l'),
+    ('millis',  'l'),
+    ('accum',   'l'),
+    ('exptime', 'd'),
+    ('gain',    'l'),
+    ('temp',    'l'),
+] + [ (key, 'l' if key.startswith('raw_') else 'd') for key in COLOUR_KEYS ] + [
+    ('tstamp',  'd'),
+]
+
+# Spilled chunk header: number of rows in chunk
+CHUNK_HEADER = struct.Struct('<I')
+
+# ----------------
+# Module functions
+# ----------------
+
+def integral(value):
+    '''int() that refuses to truncate'''
+    result = int(value)
+    if result != value:
+        raise ValueError("Non integral value {0!r}".format(value))
+    return result
+
+# Value conversions, in AS7262_SCHEMA order, shared with the streamed CSV rows
+CONVERTERS = [ integral if code == 'l' else float for _, code in AS7262_SCHEMA ]
+
+
+def readChunks(fd, chunkset):
+    '''Iterates over spilled chunks, given as (offset, rows), as lists of columns'''
+    for offset, rows in chunkset:
+        fd.seek(offset + CHUNK_HEADER.size)
+        chunk = []
+        for _, code in AS7262_SCHEMA:
+            column = array(code)
+            column.fromfile(fd, rows)
+            chunk.append(column)
+        yield chunk
+
+
+def columnBatches(chunks, columns, size):
+    '''Lists of columns of at most size rows, from spilled chunks then in-memory columns'''
+    for chunk in chunks:
+        for start in range(0, len(chunk[0]), size):
+            yield [ column[start:start+size] for column in chunk ]
+    for start in range(0, len(columns[0]), size):
+        yield [ column[start:start+size] for column in columns ]
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# -------
+# Classes
+# -------
+
+class SampleStore(object):
+    '''
+    Columnar in-memory store of AS7262 readings.
+    Every field is kept in its own typed array, growing amortised.
+
+    If capacity is given, at most that many rows are held in memory.
+    When the capacity is reached, rows are either spilled to a scratch
+    file in spill_dir (if given) or the oldest rows are dropped.
+    '''
+
+    def __init__(self, capacity=None, spill_dir=None):
+        self.capacity  = capacity
+        self.spill_dir = spill_dir
+        self.names     = [ name for name, _ in AS7262_SCHEMA ]
+        self._columns  = [ array(code) for _, code in AS7262_SCHEMA ]
+        self._index    = dict(zip(self.names, self._columns))
+        self._spilled  = 0
+        self._dropped  = 0
+        self._spill    = None
+        self._path     = None
+        self._chunkset = []   # (file offset, rows) of spilled chunks
+
+    def __len__(self):
+        '''Number of rows available, including those spilled to disk'''
+        return self._spilled + len(self._columns[0])
+
+    @property
+    def dropped(self):
+        '''Number of rows dropped because of the capacity limit'''
+        return self._dropped
+
+    @property
+    def nbytes(self):
+        '''Memory used by in-memory rows'''
+        return sum(column.itemsize * len(column) for column in self._columns)
+
+    # -------------
+    # Store methods
+    # -------------
+
+    def append(self, reading):
+        '''
+        Appends an AS7262Reading.
+        Raises ValueError, leaving the store untouched, if a value does not fit its column.
+        '''
+        columns = self._columns
+        values  = [ convert(value) for convert, value in zip(CONVERTERS, reading[1:]) ]
+        for column, value in zip(columns, values):
+            column.append(value)
+        if self.capacity is not None and len(columns[0]) >= self.capacity:
+            if self.spill_dir is not None:
+                self._spillChunk()
+            elif len(columns[0]) >= self.capacity + max(1, self.capacity // 4):
+                # Trim in blocks to keep appends amortised O(1)
+                n = len(columns[0]) - self.capacity
+                for column in columns:
+                    del column[:n]
+                self._dropped += n
+
+    def clear(self):
+        '''Empties the store and removes any scratch file'''
+        for column in self._columns:
+            del column[:]
+        if self._spill is not None:
+            self._spill.close()
+            os.remove(self._path)
+        self._spill    = None
+        self._path     = None
+        self._chunkset = []
+        self._spilled  = 0
+        self._dropped  = 0
+
+    def column(self, name):
+        '''Returns a typed array with all values of a given column'''
+        i = self.names.index(name)
+        result = array(AS7262_SCHEMA[i][1])
+        for chunk in self._chunks():
+            result.extend(chunk[i])
+        result.extend(self._columns[i])
+        return result
+
+    def tail(self, name, n):
+        '''Returns a typed array with the last n values of a given column'''
+        column = self._index[name]
+        if n <= len(column):
+            return column[len(column)-n:]
+        # Only read back the trailing chunks needed
+        i = self.names.index(name)
+        start, rows = len(self._chunkset), len(column)
+        while start > 0 and rows < n:
+            start -= 1
+            rows += self._chunkset[start][1]
+        result = array(AS7262_SCHEMA[i][1])
+        for chunk in self._chunks(start):
+            result.extend(chunk[i])
+        result.extend(column)
+        return result[max(0, len(result)-n):]
+
+    def readings(self):
+        '''Iterates over all stored rows as AS7262Reading records'''
+        for chunk in self._chunks():
+            for row in zip(*chunk):
+                yield AS7262Reading('AS7262', *row)
+        for row in zip(*self._columns):
+            yield AS7262Reading('AS7262', *row)
+
+    __iter__ = readings
+
+    def batches(self, size):
+        '''
+        Iterates over all stored rows as lists of columns
+        (typed arrays in schema order) of at most size rows
+        '''
+        return columnBatches(self._chunks(), self._columns, size)
+
+    def snapshot(self):
+        '''
+        Copy of the stored rows that can be iterated in another thread
+        while the store keeps changing. Spilled chunks are not copied but
+        read back through a file handle of its own.
+        '''
+        spill = open(self._path, 'rb') if self._spill is not None else None
+        return SampleSnapshot([ column[:] for column in self._columns ], list(self._chunkset), spill)
+
+    # --------------
+    # Helper methods
+    # --------------
+
+    def _spillChunk(self):
+        if self._spill is None:
+            fd, self._path = tempfile.mkstemp(prefix='calas7262-', suffix='.spill', dir=self.spill_dir)
+            self._spill = os.fdopen(fd, 'w+b')
+        rows = len(self._columns[0])
+        self._spill.seek(0, os.SEEK_END)
+        self._chunkset.append((self._spill.tell(), rows))
+        self._spill.write(CHUNK_HEADER.pack(rows))
+        for column in self._columns:
+            column.tofile(self._spill)
+            del column[:]
+        self._spill.flush()
+        self._spilled += rows
+
+    def _chunks(self, start=0):
+        '''Iterates over spilled chunks from a given one, as lists of columns'''
+        return readChunks(self._spill, self._chunkset[start:])
+
+
+class SampleSnapshot(object):
+    '''
+    Read only copy of the rows of a SampleStore, see SampleStore.snapshot().
+    The spill file handle, if any, is closed once the rows are iterated.
+    '''
+
+    def __init__(self, columns, chunkset, spill):
+        self._columns  = columns
+        self._chunkset = chunkset
+        self._spill    = spill
+
+    def __len__(self):
+        return sum(rows for _, rows in self._chunkset) + len(self._columns[0])
+
+    def batches(self, size):
+        '''Same as SampleStore.batches()'''
+        chunks = readChunks(self._spill, self._chunkset) if self._spill is not None else ()
+        try:
+            for batch in columnBatches(chunks, self._columns, size):
+                yield batch
+        finally:
+            if self._spill is not None:
+                self._spill.close()
+
+
+__all__ = [
+    "AS7262_SCHEMA",
+    "CONVERTERS",
+    "SampleStore",
+    "SampleSnapshot",
+]
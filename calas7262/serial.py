@@ -10,6 +10,9 @@
 
 from __future__ import division, absolute_import
 
+from collections import OrderedDict
+from functools   import partial
+
 # ---------------
 # Twisted imports
 # ---------------
@@ -18,6 +21,7 @@ from twisted.logger               import Logger
 from twisted.internet             import reactor
 from twisted.internet.defer       import inlineCallbacks, returnValue
 from twisted.internet.serialport  import SerialPort
+from twisted.internet.task        import LoopingCall
 from twisted.application.service  import Service
 
 #--------------
@@ -25,7 +29,9 @@ from twisted.application.service  import Service
 # -------------
 
 from calas7262.logger   import setLogLevel
-from calas7262.utils    import chop
+from calas7262.utils    import chop, devicePath
+from calas7262.replay   import ReplayTransport
+from calas7262.capture  import CaptureWriter
 
 
 # -----------------------
@@ -64,35 +70,56 @@ class SerialService(Service):
         protocol_level  = 'info' if self.options['log_messages'] else 'warn'
         setLogLevel(namespace='proto', levelStr=protocol_level)
         setLogLevel(namespace='serial', levelStr=self.options['log_level'])
-        self.serport   = None
-        self.protocol  = None
-        self.endpoint  = None
+        self.devices   = options['devices']
+        self.protocols = OrderedDict()     # device id => protocol, in endpoint order
+        self.serports  = {}
         self.factory   = None
+        self.captures  = {}
+        self.ready     = set()
     
     def startService(self):
         '''
-        Starts the Serial Service that listens to a SpectralDevice
+        Starts the Serial Service that listens to the SpectralDevices,
+        one per endpoint
         '''
         log.info("starting Serial Service")
-        parts = chop(self.options['endpoint'], sep=':')
+        for device, endpoint in zip(self.devices, self.options['endpoints']):
+            self.connect(device, endpoint)
+
+    def connect(self, device, endpoint):
+        parts = chop(endpoint, sep=':')
         if parts[0] == 'serial':
-            self.endpoint = parts[1:]
-            if self.serport is None:
-                self.protocol = self.factory.buildProtocol(0)
-                self.serport  = SerialPort(self.protocol, self.endpoint[0], reactor, baudrate=self.endpoint[1])
-            self.gotProtocol(self.protocol)
-            log.info("Using serial port {tty} at {baud} bps", tty=self.endpoint[0], baud=self.endpoint[1])
+            endpoint = parts[1:]
+            if device not in self.serports:
+                protocol = self.factory.buildProtocol(0)
+                self.serports[device] = SerialPort(protocol, endpoint[0], reactor, baudrate=endpoint[1])
+                self.gotProtocol(device, protocol)
+            log.info("[{device}] Using serial port {tty} at {baud} bps", device=device, tty=endpoint[0], baud=endpoint[1])
+        elif parts[0] == 'replay':
+            # replay:<capture file>[:<speed factor>|max]
+            endpoint = parts[1:]
+            speed = endpoint[1] if len(endpoint) > 1 else '1'
+            speed = None if speed == 'max' else float(speed)
+            if device not in self.serports:
+                protocol = self.factory.buildProtocol(0)
+                self.serports[device] = ReplayTransport(protocol, endpoint[0], speed)
+                self.gotProtocol(device, protocol)
+            log.info("[{device}] Replaying capture {path} at speed {speed}", device=device, path=endpoint[0], speed=speed or 'max')
         else:
-            raise
+            raise ValueError("Unknown endpoint {0}".format(endpoint))
 
     
-    def enableMessages(self):
+    def enableMessages(self, device=None):
+        '''Starts readings from one or all devices'''
         log.info("enabling messages from hardware")
-        self.protocol.enableMessages()
+        for protocol in self._select(device):
+            protocol.enableMessages()
       
-    def disableMessages(self):
+    def disableMessages(self, device=None):
+        '''Stops readings from one or all devices'''
         log.info("disabling messages from hardware")
-        self.protocol.disableMessages()
+        for protocol in self._select(device):
+            protocol.disableMessages()
 
             
 
@@ -103,29 +130,52 @@ class SerialService(Service):
     def setFactory(self, factory):
         self.factory = factory
 
-
-    def gotProtocol(self, protocol):
-        log.debug("Serial: Got Protocol")
-        self.protocol  = protocol
-        self.protocol.addReadingCallback(self.onReading)
-        self.protocol.addDeviceReadyCallback(self.onDeviceReady)
+    def _select(self, device):
+        return self.protocols.values() if device is None else [self.protocols[device]]
+
+    def gotProtocol(self, device, protocol):
+        log.debug("Serial: Got Protocol for {device}", device=device)
+        self.protocols[device] = protocol
+        protocol.logMessages = self.options['log_messages']
+        protocol.addReadingCallback(partial(self.onReading, device=device))
+        protocol.addDeviceReadyCallback(partial(self.onDeviceReady, device))
+        if self.options['capture'] is not None and device not in self.captures:
+            path = self.options['capture']
+            if len(self.devices) > 1:
+                path = devicePath(path, device)
+            self.startCapture(device, path)
+
+    def startCapture(self, device, path):
+        '''
+        Record raw serial data to a binary capture file,
+        flushing batched writes once a second
+        '''
+        capture = self.captures[device] = CaptureWriter(path)
+        capture.open()
+        self.protocols[device].addRawDataCallback(capture.record)
+        flusher = LoopingCall(capture.flush)
+        flusher.start(1, now=False)
+        reactor.addSystemEventTrigger('before', 'shutdown', capture.close)
+        log.info("capturing raw serial data to {path}", path=path)
 
     # ----------------------------
     # Event Handlers from Protocol
     # -----------------------------
 
-    def onReading(self, reading):
+    def onReading(self, reading, device):
         '''
-        Pass it onwards when a new reading is made
+        Pass it onwards when a new reading is made, tagged with its device id
         '''
-        self.parent.onReading(reading, self)
+        self.parent.onReading(reading, device)
        
 
-    def onDeviceReady(self):
+    def onDeviceReady(self, device):
         '''
-        Pass it onwards when a new reading is made
+        Pass it onwards once every device is ready
         '''
-        self.parent.onDeviceReady()
+        self.ready.add(device)
+        if len(self.ready) == len(self.devices):
+            self.parent.onDeviceReady()
        
 
 __all__ = [
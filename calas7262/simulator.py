@@ -0,0 +1,202 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+'''
+AS7262 firmware simulator on a pseudo-terminal, for load testing.
+
+    python -m calas7262.simulator --rate 1000 &
+    calas7262 -w 500 --port /dev/pts/N
+
+Repeats a boot banner until the first command is received, then emits
+AS7262 ("A") and OPT3001 ("O") JSON frames at the given rate while
+enabled by 'x' and until disabled by 'z', as the firmware does.
+'''
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import, print_function
+
+import os
+import sys
+import tty
+import time
+import errno
+import fcntl
+import random
+import select
+import argparse
+
+#--------------
+# local imports
+# -------------
+
+from calas7262 import __version__
+
+# ----------------
+# Module constants
+# ----------------
+
+# Boot banner lines, not JSON
+BANNER = [
+    b"",
+    b"AS7262 streetcolors",
+    b"firmware simulator " + __version__.encode('ascii'),
+    b"Initializing AS7262 ...",
+    b"Initializing OPT3001 ...",
+    b"Send x to start, z to stop",
+]
+
+# Calibrated band fluxes at gain 1 and 1 ms exposure, violet to red
+BANDS = [2.0, 3.1, 4.2, 2.6, 1.4, 0.7]
+
+# Max. frames generated per loop iteration when behind schedule
+BATCH = 1000
+
+# Max. bytes pending to be read by the client. Beyond that, frames are dropped
+MAX_PENDING = 1024*1024
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def cmdline():
+    parser = argparse.ArgumentParser(prog='calas7262.simulator')
+    parser.add_argument('-r', '--rate', type=float, default=10.0, help='AS7262 frames per second')
+    parser.add_argument('-o', '--lux-every', type=int, default=1, help='one OPT3001 frame every N AS7262 frames (0 = none)')
+    parser.add_argument('-n', '--noise', type=float, default=0.01, help='relative gaussian noise')
+    parser.add_argument('-g', '--gain', type=int, default=16, choices=[1, 4, 16, 64], help='sensor gain')
+    parser.add_argument('-e', '--exptime', type=float, default=357.0, help='exposure time (ms)')
+    parser.add_argument('-t', '--temp', type=int, default=28, help='sensor temperature (C)')
+    parser.add_argument('-b', '--banner-period', type=float, default=2.0, help='boot banner period until first command (s)')
+    parser.add_argument('-s', '--seed', type=int, default=None, help='random seed for reproducible runs')
+    return parser.parse_args()
+
+
+class Simulator(object):
+
+    def __init__(self, options):
+        self.options = options
+        self.enabled = False
+        self.booted  = False
+        self.seq     = 0
+        self.t0      = time.time()
+        self.random  = random.Random(options.seed)
+        self.scale   = options.gain * options.exptime
+        self.pending = b''
+        self.dropped = 0
+
+    def output(self, data):
+        if len(self.pending) + len(data) > MAX_PENDING:
+            self.dropped += 1
+        else:
+            self.pending += data
+
+    def millis(self):
+        return int((time.time() - self.t0) * 1000)
+
+    def as7262Frame(self):
+        self.seq += 1
+        fields = [ '"A"', str(self.seq), str(self.millis()), '1', repr(self.options.exptime), str(self.options.gain), str(self.options.temp) ]
+        for band in BANDS:
+            value = band * self.scale * (1 + self.random.gauss(0, self.options.noise))
+            fields.append('{0:.2f}'.format(value))
+            fields.append(str(int(value / 2.8)))
+        return ('[' + ','.join(fields) + ']\r\n').encode('ascii')
+
+    def opt3001Frame(self):
+        lux = 100.0 * (1 + self.random.gauss(0, self.options.noise))
+        return '["O",{0},{1},1,800,{2:.2f}]\r\n'.format(self.seq, self.millis(), lux).encode('ascii')
+
+    def frames(self, n):
+        chunks = []
+        lux_every = self.options.lux_every
+        for i in range(n):
+            chunks.append(self.as7262Frame())
+            if lux_every and self.seq % lux_every == 0:
+                chunks.append(self.opt3001Frame())
+        return b''.join(chunks)
+
+    def command(self, data):
+        for byte in bytearray(data):
+            if byte == ord('x'):
+                self.enabled = self.booted = True
+            elif byte == ord('z'):
+                self.enabled = False
+                self.booted  = True
+
+    def run(self, master):
+        period = 1.0 / self.options.rate
+        banner = 0
+        due = time.time()
+        while True:
+            now = time.time()
+            if not self.booted and now >= banner:
+                self.output(b'\r\n'.join(BANNER) + b'\r\n')
+                banner = now + self.options.banner_period
+            if self.enabled and now >= due:
+                n = min(BATCH, int((now - due) / period) + 1)
+                self.output(self.frames(n))
+                due += n * period
+                if now - due > 1.0:
+                    due = now   # too far behind, do not try to catch up
+            if not self.enabled:
+                due = time.time()
+                timeout = 0.1
+            else:
+                timeout = max(0, due - time.time())
+            writers = [master] if self.pending else []
+            readable, writable, _ = select.select([master], writers, [], timeout)
+            if readable:
+                self.command(read(master))
+            if writable:
+                n = write(master, self.pending)
+                self.pending = self.pending[n:]
+
+
+def write(fd, data):
+    try:
+        return os.write(fd, data)
+    except OSError as e:
+        # Nobody reading the slave side and buffers full
+        if e.errno in (errno.EAGAIN, errno.EIO):
+            return 0
+        raise
+
+
+def read(fd):
+    try:
+        return os.read(fd, 64)
+    except OSError as e:
+        if e.errno in (errno.EAGAIN, errno.EIO):   # slave side closed
+            return b''
+        raise
+
+
+def main():
+    options = cmdline()
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    flags = fcntl.fcntl(master, fcntl.F_GETFL)
+    fcntl.fcntl(master, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+    print("AS7262 simulator listening on {0} ({1} frames/s)".format(os.ttyname(slave), options.rate))
+    sys.stdout.flush()
+    try:
+        Simulator(options).run(master)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os.close(master)
+        os.close(slave)
+
+
+if __name__ == '__main__':
+    main()
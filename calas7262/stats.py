@@ -12,16 +12,12 @@
 from __future__ import division, absolute_import
 
 import sys
+import time
 import datetime
 import random
 import os
 import math
-import statistics
 
-from collections import deque
-
-
-import tabulate
 
 # ---------------
 # Twisted imports
@@ -38,11 +34,10 @@ from twisted.application.service  import Service
 # local imports
 # -------------
 
-from calas7262 import __version__
-from calas7262.config import VERSION_STRING, loadCfgFile
+from calas7262 import __version__, metrics
 from calas7262.logger import setLogLevel
-from calas7262.config import cmdline
-from calas7262.protocol   import COLOUR_KEYS
+from calas7262.protocol   import COLOUR_KEYS, AS7262_KEYS
+from calas7262.bandstats  import summarize, Welford, SlidingWindow
 
 
 # ----------------
@@ -80,12 +75,20 @@ class StatsService(Service):
     NAME = 'Statistics Service'
 
 
-    def __init__(self, options):
+    def __init__(self, options, device=None):
         Service.__init__(self)
         setLogLevel(namespace='stats', levelStr=options['log_level'])
         self.started    = False
         self.options    = options
+        self.device     = device
         self.qsize      = options['size']
+        self.streaming  = options['streaming']
+        self.rolling    = options['rolling']
+        self.tolerance  = options['tolerance']
+        self.minsize    = options['min_size']
+        self.maxsize    = options['max_size']
+        self.refresh    = options['refresh']
+        self.pending    = None
         self.wavelength = options['wavelength']
         self.photodiode = options['photodiode']
         if self.photodiode is not None:
@@ -96,31 +99,28 @@ class StatsService(Service):
         '''
         Starts Stats service
         '''
-        log.info("starting Stats Service: Window Size= {w} samples", 
-            w=self.options['size'])
+        log.info("starting Stats Service: Window Size= {w} samples, streaming = {s}, rolling = {r}", 
+            w=self.options['size'], s=self.streaming, r=self.rolling)
+        if self.tolerance is not None:
+            log.info("stopping when relative std. error < {t} for all bands, with {m} to {M} samples", 
+                t=self.tolerance, m=self.minsize, M=self.maxsize)
         Service.startService(self)
         reactor.callLater(0, self.accumulate)
         self.nsamples = 0
         self.started = True
-        self.queue      = { 
-            'violet'     : deque([], self.qsize),
-            'blue'       : deque([], self.qsize),
-            'green'      : deque([], self.qsize),
-            'yellow'     : deque([], self.qsize),
-            'orange'     : deque([], self.qsize),
-            'red'        : deque([], self.qsize),
-            'raw_violet' : deque([], self.qsize),
-            'raw_blue'   : deque([], self.qsize),
-            'raw_green'  : deque([], self.qsize),
-            'raw_yellow' : deque([], self.qsize),
-            'raw_orange' : deque([], self.qsize),
-            'raw_red'    : deque([], self.qsize),
-        } 
+        self.completing = False
+        self.lastRefresh = 0
+        # In streaming or adaptive mode, (accumulator, reading field index) per band
+        self.accumulators = [ (Welford(), AS7262_KEYS.index(key)) for key in COLOUR_KEYS ]
+        # In rolling mode, (sliding window, reading field index) per band
+        self.windows = [ (SlidingWindow(self.qsize), AS7262_KEYS.index(key)) for key in COLOUR_KEYS ]
         log.info("photodiode current (A) = {current}", current= self.photodiode)
        
     def stopService(self):
         log.info("stopping Stats Service")
         self.started = False
+        if self.pending is not None and not self.pending.called:
+            self.pending.cancel()
         return Service.stopService(self)
 
 
@@ -130,6 +130,27 @@ class StatsService(Service):
         '''
         self.photodiode = '{:.6e}'.format(float(current[0]))
         log.info("photodiode current (A) = {current}", current= self.photodiode)
+
+    def setWavelength(self, wavelength):
+        '''
+        New sweep step. The photodiode current must be entered again
+        '''
+        self.wavelength = wavelength
+        self.photodiode = self.options['photodiode']
+        if self.photodiode is not None:
+            self.photodiode = '{:.6e}'.format(self.photodiode)
+
+    @inlineCallbacks
+    def onCalibrationStop(self):
+        '''
+        Operator request to end the acquisition with the current window
+        '''
+        if not self.started:
+            returnValue(None)
+        if self.nsamples < 2:
+            log.warn("Not enough samples yet to compute statistics")
+            returnValue(None)
+        yield self.complete()
     
     # --------------
     # Main task
@@ -142,58 +163,185 @@ class StatsService(Service):
         '''
         log.debug("starting statistics loop")
         while self.started:
-            sample = yield self.parent.queue['AS7262'].get()
+            self.pending = self.parent.queues[self.device]['AS7262'].get()
+            try:
+                sample = yield self.pending
+            except defer.CancelledError:
+                break
+            if self.completing:
+                # Results being computed, this reading is not part of them
+                break
+            if not self.parent.onSampleAccepted(sample, self.device):
+                continue
             self.nsamples += 1
-            log.info("received AS7262 sample {n}/{N}", n=self.nsamples, N=self.qsize)
-            self.exptime = sample['exptime']
-            self.gain    = sample['gain']
-            self.accum   = sample['accum']
-            self.queue['violet'].append(sample['violet'])
-            self.queue['blue'].append(sample['blue'])
-            self.queue['green'].append(sample['green'])
-            self.queue['yellow'].append(sample['yellow'])
-            self.queue['orange'].append(sample['orange'])
-            self.queue['red'].append(sample['red'])
-            self.queue['raw_violet'].append(sample['raw_violet'])
-            self.queue['raw_blue'].append(sample['raw_blue'])
-            self.queue['raw_green'].append(sample['raw_green'])
-            self.queue['raw_yellow'].append(sample['raw_yellow'])
-            self.queue['raw_orange'].append(sample['raw_orange'])
-            self.queue['raw_red'].append(sample['raw_red'])
-            if len(self.queue['red']) == self.qsize:
-                masterEntry, detailEntry, statsEntry = self.computeStats()
-                tables = self.formatStats(masterEntry, detailEntry)
-                yield self.parent.onStatsComplete(statsEntry, tables)
-                yield self.stopService()
+            log.info("[{device}] received AS7262 sample {n}/{N}", device=self.device, n=self.nsamples, N=self.qsize)
+            self.exptime = sample.exptime
+            self.gain    = sample.gain
+            self.accum   = sample.accum
+            if self.streaming or self.tolerance is not None:
+                for accumulator, i in self.accumulators:
+                    accumulator.add(sample[i])
+            if self.rolling:
+                for window, i in self.windows:
+                    window.add(sample[i])
+                self.displayRolling()
+                # Interactive rolling acquisitions end with the 'stop' command
+                if not self.parent.options['automatic']:
+                    continue
+            if self.isComplete():
+                yield self.complete()
+
+    def isComplete(self):
+        '''
+        Fixed size acquisitions end after qsize samples.
+        Adaptive ones as soon as the standard error of the mean
+        of every band falls below the relative tolerance.
+        '''
+        if self.tolerance is None:
+            return self.nsamples == self.qsize
+        if self.nsamples < self.minsize:
+            return False
+        if self.nsamples >= self.maxsize:
+            log.warn("maximum number of samples reached before converging")
+            return True
+        for accumulator, _ in self.accumulators:
+            # standard error <= tolerance * |mean|, squared to avoid sqrt
+            if accumulator.variance / accumulator.n > (self.tolerance * accumulator.mean)**2:
+                return False
+        log.info("converged after {n} samples", n=self.nsamples)
+        return True
+
+    @inlineCallbacks
+    def complete(self):
+        # Both the statistics loop and the 'stop' command may end the acquisition
+        if self.completing:
+            returnValue(None)
+        self.completing = True
+        # No more readings while the results are being computed
+        self.parent.serialService.disableMessages(self.device)
+        if metrics.enabled:
+            t0 = metrics.clock()
+        pool = self.parent.pool
+        if pool is not None:
+            # Statistics and tables computed by a worker process,
+            # the reactor keeps serving the other devices meanwhile
+            header = self.acquisition()
+            if self.streaming:
+                statsEntry, tables = yield pool.run(renderSummary, header, self.summary())
+            else:
+                statsEntry, tables = yield pool.run(renderWindow, header, self.window(header[0]))
+            if metrics.enabled:
+                metrics.observe('compute', metrics.clock() - t0)
+        else:
+            masterEntry, detailEntry, statsEntry = self.computeStats()
+            if metrics.enabled:
+                t1 = metrics.clock()
+                metrics.observe('compute', t1 - t0)
+            tables = self.formatStats(masterEntry, detailEntry)
+            if metrics.enabled:
+                metrics.observe('format', metrics.clock() - t1)
+        yield self.parent.onStatsComplete(self.device, statsEntry, tables)
+        yield self.stopService()
+
+    def displayRolling(self):
+        '''
+        Pushes the running statistics to the console, at most once every refresh seconds
+        '''
+        now = time.time()
+        if now - self.lastRefresh < self.refresh:
+            return
+        self.lastRefresh = now
+        window = self.windows[0][0]
+        fields = [ "{0}={1:.2f}+-{2:.2f}".format(key, w.mean, w.stdev) 
+            for key, (w, _) in zip(COLOUR_KEYS, self.windows) if not key.startswith('raw_') ]
+        self.parent.onRollingStats("[{0}/{1}] {2}".format(window.n, self.nsamples, " ".join(fields)), self.device)
                
     # --------------
     # Main task
     # ---------------
 
+    def acquisition(self):
+        '''Acquisition header: N, wavelength, exposure time, gain, accumulated and photodiode current'''
+        if self.streaming:
+            N = self.nsamples
+        elif self.rolling:
+            N = self.windows[0][0].n
+        elif self.tolerance is not None:
+            N = self.nsamples
+        else:
+            N = min(self.nsamples, self.qsize)
+        return (N, self.wavelength, self.exptime, self.gain, self.accum, self.photodiode)
+
+    def summary(self):
+        '''Per band summary of the streaming accumulators'''
+        return dict( (key, accumulator.summary()) for key, (accumulator, _) in zip(COLOUR_KEYS, self.accumulators) )
+
+    def window(self, N):
+        '''Copy of the last N values of every band, in COLOUR_KEYS order'''
+        if self.rolling:
+            return [ list(window.values) for window, _ in self.windows ]
+        # The stats window is the last qsize samples in the parent's sample store
+        samples = self.parent.samples[self.device]
+        return [ samples.tail(key, N) for key in COLOUR_KEYS ]
+
     def computeStats(self):
-        masterEntry = []
-        masterEntry.append([self.qsize, self.wavelength, self.exptime, self.gain, self.accum])
-        detailEntry = []
-        statsEntry = {}
-        statsEntry['N'] = self.qsize
-        statsEntry['wavelength'] = self.wavelength
-        statsEntry['photodiode'] = self.photodiode
-        for key in COLOUR_KEYS:   #['violet'.'blue','green','yellow','orange','red']:
-            central = statistics.mean(self.queue[key])
-            stddev  = round(statistics.stdev(self.queue[key], central), 2)
-            central = round(central,2)
-            detailEntry.append([key, central, stddev])
-            statsEntry[key] = central
-            statsEntry[key + ' stddev'] = stddev
-        return masterEntry, detailEntry, statsEntry
+        header = self.acquisition()
+        if self.streaming:
+            summary = self.summary()
+        else:
+            summary = summarize(COLOUR_KEYS, self.window(header[0]))
+        return statsEntries(header, summary)
 
     def formatStats(self, masterEntry, detailEntry):
-        headMas=["Samples","Wavelength (nm)","Exp. Time (ms)", "Gain", "Accumulated"]
-        table1 = tabulate.tabulate(masterEntry, headers=headMas, tablefmt='grid')
-        headDet=["Band","Average Flux","Std. Deviation"]
-        table2 = tabulate.tabulate(detailEntry, headers=headDet, tablefmt='grid')
-        return (table1, table2)
+        return formatTables(masterEntry, detailEntry)
        
+# ----------------
+# Module functions
+# ----------------
+
+def statsEntries(header, summary):
+    '''
+    Table entries and CSV statistics dictionary from 
+    an acquisition header and the per band summary
+    '''
+    N, wavelength, exptime, gain, accum, photodiode = header
+    masterEntry = []
+    masterEntry.append([N, wavelength, exptime, gain, accum])
+    detailEntry = []
+    statsEntry = {}
+    statsEntry['N'] = N
+    statsEntry['wavelength'] = wavelength
+    statsEntry['photodiode'] = photodiode
+    for key in COLOUR_KEYS:   #['violet'.'blue','green','yellow','orange','red']:
+        entry   = summary[key]
+        central = round(entry['mean'], 2)
+        stddev  = round(entry['stdev'], 2)
+        median  = round(entry['median'], 2) if entry['median'] is not None else None
+        detailEntry.append([key, central, stddev, median, entry['min'], entry['max']])
+        statsEntry[key] = central
+        statsEntry[key + ' stddev'] = stddev
+    return masterEntry, detailEntry, statsEntry
+
+
+def formatTables(masterEntry, detailEntry):
+    # Slow to import, only loaded when tables are first rendered
+    import tabulate
+    headMas=["Samples","Wavelength (nm)","Exp. Time (ms)", "Gain", "Accumulated"]
+    table1 = tabulate.tabulate(masterEntry, headers=headMas, tablefmt='grid')
+    headDet=["Band","Average Flux","Std. Deviation","Median","Min.","Max."]
+    table2 = tabulate.tabulate(detailEntry, headers=headDet, tablefmt='grid')
+    return (table1, table2)
+
+
+def renderSummary(header, summary):
+    '''Worker process task: CSV statistics and tables from a per band summary'''
+    masterEntry, detailEntry, statsEntry = statsEntries(header, summary)
+    return statsEntry, formatTables(masterEntry, detailEntry)
+
+
+def renderWindow(header, columns):
+    '''Worker process task: CSV statistics and tables from a window of values per band'''
+    return renderSummary(header, summarize(COLOUR_KEYS, columns))
         
 
 __all__ = [ "StatsService" ]
\ No newline at end of file
@@ -13,10 +13,8 @@ from __future__ import division, absolute_import
 
 import datetime
 import os.path
-import csv
 
 from collections   import OrderedDict
-from pkg_resources import resource_filename
 
 # ---------------
 # Twisted imports
@@ -25,22 +23,51 @@ from pkg_resources import resource_filename
 from twisted.logger   import Logger, LogLevel
 from twisted.internet import task, reactor, defer
 from twisted.internet.defer  import inlineCallbacks, returnValue, DeferredList
-from twisted.internet.threads import deferToThread
 from twisted.application.service  import Service
 
 #--------------
 # local imports
 # -------------
 
+from calas7262          import metrics
 from calas7262.logger   import setLogLevel
+from calas7262.utils    import devicePath
 from calas7262.protocol import AS7262_KEYS
+from calas7262.samplelog import SampleLogWriter
+from calas7262.csvwriter import CSVWriter
+from calas7262.export    import TSTAMP_FORMAT, SAMPLES_HEADER, sampleRow, sampleBatches
+from calas7262.qe        import QECurve
 
 
 # ----------------
 # Module constants
 # ----------------
 
-TSTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# Summary statistics keys and their CSV column headers
+SUMMARY_KEYS = ['tstamp', 'N', 'wavelength', 'photodiode', 'quantum_eff',
+    'violet', 'violet stddev', 'raw_violet', 'raw_violet stddev',
+    'blue',   'blue stddev',   'raw_blue',   'raw_blue stddev',
+    'green',  'green stddev',  'raw_green',  'raw_green stddev', 
+    'yellow', 'yellow stddev', 'raw_yellow', 'raw_yellow stddev',
+    'orange', 'orange stddev', 'raw_orange', 'raw_orange stddev',
+    'red',    'red stddev',    'raw_red',    'raw_red stddev'
+]
+SUMMARY_HEADER = ['Timestamp', '# Samples', 'Wavelength', 'Photod. I (A)', 'Photod. QE',
+    'Violet', 'StdDev', 'Violet (raw)', 'StdDev',
+    'Blue',   'StdDev',   'Blue (raw)', 'StdDev',
+    'Green',  'StdDev',  'Green (raw)', 'StdDev',
+    'Yellow', 'StdDev', 'Yellow (raw)', 'StdDev',
+    'Orange', 'StdDev', 'Orange (raw)', 'StdDev',
+    'Red',    'StdDev',    'Red (raw)', 'StdDev'
+]
+
+LUX_HEADER = ['Timestamp', '# Samples', 'Wavelength', 'Lux', 'StdDev', 'Min.', 'Max.']
+
+# Streamed sample rows handed to the writer at once
+STREAM_BATCH = 256
+
+# Max. seconds streamed sample rows are held before being handed to the writer
+STREAM_PERIOD = 1.0
 
 # -----------------------
 # Module global variables
@@ -48,6 +75,14 @@ TSTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
 log = Logger(namespace='storag')
 
+# ------------------------
+# Module Utility Functions
+# ------------------------
+
+def tagged(row, device):
+    '''Inserts a device id (or header) after the timestamp column'''
+    return [row[0], device] + list(row[1:])
+
 # -----------------------------------------------------------------------------
 # -----------------------------------------------------------------------------    
 # -----------------------------------------------------------------------------  
@@ -64,7 +99,16 @@ class StorageService(Service):
         setLogLevel(namespace='stats', levelStr=options['log_level'])
         self.started    = False
         self.options    = options
-        self.qe_data    = {}
+        self.qe         = None
+        self.devices    = options['devices']
+        # With several devices, rows are tagged with their device id
+        self.multi      = len(self.devices) > 1
+        self.sampleLogs = {}
+        self.writer     = CSVWriter()
+        self.streaming  = False
+        self.streamRows = []
+        self.streamMeta = {}
+        self.streamTask = task.LoopingCall(self.pushSamples)
         
 
     def startService(self):
@@ -73,111 +117,162 @@ class StorageService(Service):
         '''
         log.info("starting Storage Service")
         Service.startService(self)
-        path = resource_filename(__name__, 'data/QE_photodiode.csv')
-        self.loadQE(path)
-        log.debug("QE data is {qe}",qe=self.qe_data)
+        self.loadQE(self.options['qe_file'])
+        log.info("QE curve is {qe}", qe=self.qe)
+        self.writer.start()
+        reactor.addSystemEventTrigger('before', 'shutdown', self.onShutdown)
+        if self.options['sample_log'] is not None:
+            # Binary records have no device field, so one log per device
+            for device in self.devices:
+                path = devicePath(self.options['sample_log'], device) if self.multi else self.options['sample_log']
+                sampleLog = self.sampleLogs[device] = SampleLogWriter(path)
+                sampleLog.open()
+                reactor.addSystemEventTrigger('before', 'shutdown', sampleLog.close)
+                log.info("recording every sample to {file}", file=path)
 
        
     def stopService(self):
         log.info("stopping Stats Service")
         return Service.stopService(self)
 
+    def setWavelength(self, wavelength):
+        self.options['wavelength'] = wavelength
+
+    def onCalibrationStart(self):
+        for sampleLog in self.sampleLogs.values():
+            run = sampleLog.startRun(self.options['wavelength'])
+            log.info("sample log run #{run} started", run=run)
+        if self.options['stream_samples']:
+            w = self.options['wavelength']
+            if not w in self.qe:
+                log.error("No available QE for the selected wavelength !!")
+                reactor.stop()
+                return
+            for device in self.devices:
+                self.streamMeta[device] = self.sampleMeta(device)
+            self.streamRows = []
+            self.streaming  = True
+            if not self.streamTask.running:
+                self.streamTask.start(STREAM_PERIOD, now=False)
+            log.info("streaming samples to {file}", file=self.options['csv_samples'])
+
+    def onReading(self, reading, device):
+        sampleLog = self.sampleLogs.get(device)
+        if sampleLog is not None and sampleLog.run is not None:
+            sampleLog.write(reading)
+        if self.streaming:
+            self.streamRows.append(sampleRow(reading, self.streamMeta[device]))
+            if len(self.streamRows) >= STREAM_BATCH:
+                self.pushSamples()
+
+    def onAcquisitionEnd(self):
+        for sampleLog in self.sampleLogs.values():
+            if sampleLog.run is not None:
+                sampleLog.endRun()
+        if self.streaming:
+            self.streaming = False
+            self.streamTask.stop()
+            self.pushSamples()
+            return self.writer.flush(self.options['csv_samples'], sync=True)
+
+    def onShutdown(self):
+        '''Writes any streamed sample still held and stops the writer thread'''
+        self.pushSamples()
+        return self.writer.stop()
+
+    def pushSamples(self):
+        '''Hands the streamed sample rows over to the writer thread'''
+        if self.streamRows:
+            self.writer.write(self.options['csv_samples'], self.streamRows, header=self.samplesHeader())
+            self.streamRows = []
+
     @inlineCallbacks
-    def onCalibrationSave(self, stats, samples):
-        yield deferToThread(self.saveSamples, samples).addCallback(self._done, self.options['csv_samples'])
-        yield deferToThread(self.saveCSV, stats).addCallback(self._done, self.options['csv_file'])
+    def onCalibrationSave(self, stats, samples, luxStats):
+        '''
+        Saves the rows of every device (stats, samples and luxStats
+        are dictionaries indexed by device id)
+        '''
+        if metrics.enabled:
+            t0 = metrics.clock()
+        for device in self.devices:
+            # Streamed samples are already in their file
+            if not self.options['stream_samples']:
+                self.saveSamples(samples[device], device)
+            self.saveCSV(stats[device], device)
+            if luxStats[device] is not None:
+                self.saveLux(luxStats[device], device)
+        # Samples are formatted by the writer thread, wait until they are on disk
+        yield self.writer.flush(sync=True)
+        log.info("CSV files saved")
+        if metrics.enabled:
+            metrics.observe('save', metrics.clock() - t0)
+            metrics.incr('saved_rows', sum(len(samples[device]) for device in self.devices))
 
     # ----------------------
     # Other Helper functions
     # ----------------------
 
-    def loadQE(self, path):
-        with open(path, mode='r') as csv_file:
-            csv_reader = csv.DictReader(csv_file)
-            line_count = 0
-            for row in csv_reader:
-                if line_count != 0:
-                    key   = int(row['WL'])
-                    value = (row['QE']).strip()
-                    self.qe_data[key] = value
-                line_count += 1
+    def loadQE(self, path=None):
+        '''Loads the photodiode QE curve, the packaged one by default'''
+        self.qe = QECurve.fromCSV(path, self.options['qe_method'])
+
 
-        
 
-    def _done(self, *args):
-        log.info("CSV file {file} saved",file=args[1])
+    def samplesHeader(self):
+        return tagged(SAMPLES_HEADER, 'device') if self.multi else SAMPLES_HEADER
 
+    def sampleMeta(self, device):
+        '''Constant columns of the sample rows: [device,] wavelength, current, QE'''
+        w = self.options['wavelength']
+        meta = (w, self.options['photodiode'], self.qe[w])
+        return (device,) + meta if self.multi else meta
 
-    def saveSamples(self, samples):
-        '''Exports summary statistics to a common CSV file'''
+    def saveSamples(self, samples, device):
+        '''Queues the samples to be appended to the samples CSV file'''
         log.debug("Appending to CSV file {file}",file=self.options['csv_samples'])
         w = self.options['wavelength']
-        if not w in self.qe_data.keys():
+        if not w in self.qe:
             log.error("No available QE for the selected wavelength !!")
             reactor.stop()
        
         # Adding metadata to the estimation
-        for sample in samples:
-            sample['tstamp'] = (sample['tstamp'] + datetime.timedelta(seconds=0.5)).strftime(TSTAMP_FORMAT)
-            sample['wavelength']  = self.options['wavelength']
-            sample['current']     = self.options['photodiode']
-            sample['quantum_eff'] = self.qe_data[w]
-        
-        keys = ['tstamp', 'wavelength', 'current', 'quantum_eff'] + AS7262_KEYS
-
-        # CSV file generation
-        writeheader = not os.path.exists(self.options['csv_samples'])
-        with open(self.options['csv_samples'], mode='a+') as csv_samples:
-            writer = csv.DictWriter(csv_samples, fieldnames=keys, delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            if writeheader:
-                writer.writeheader()
-            writer.writerows(samples)
-        log.info("updated CSV file {file}",file=self.options['csv_samples'])
-
+        meta = self.sampleMeta(device)
+        # The writer thread must not see the appends of the next acquisition.
+        # Rows are formatted in that thread: shipping batches to the worker
+        # processes costs more than formatting them
+        samples = samples.snapshot()
+        self.writer.writeBatches(self.options['csv_samples'], sampleBatches(samples, meta), header=self.samplesHeader())
 
 
-    def saveCSV(self, stats):
-        '''Exports summary statistics to a common CSV file'''
+    def saveCSV(self, stats, device):
+        '''Queues the summary statistics to be appended to the common CSV file'''
         log.debug("Appending to CSV file {file}",file=self.options['csv_file'])
         # Adding metadata to the estimation
        
         stats['tstamp']  = (datetime.datetime.utcnow() + datetime.timedelta(seconds=0.5)).strftime(TSTAMP_FORMAT)
         #stats['author']  = self.author
         w = stats['wavelength']
-        if not w in self.qe_data.keys():
+        if not w in self.qe:
             log.error("No available QE for the selected wavelength !!")
             reactor.stop()
-        stats['quantum_eff'] = self.qe_data[w]
-        
-        # transform dictionary into readable header columns for CSV export
-        oldkeys = ['tstamp', 'N', 'wavelength', 'photodiode', 'quantum_eff',
-            'violet', 'violet stddev', 'raw_violet', 'raw_violet stddev',
-            'blue',   'blue stddev',   'raw_blue',   'raw_blue stddev',
-            'green',  'green stddev',  'raw_green',  'raw_green stddev', 
-            'yellow', 'yellow stddev', 'raw_yellow', 'raw_yellow stddev',
-            'orange', 'orange stddev', 'raw_orange', 'raw_orange stddev',
-            'red',    'red stddev',    'raw_red',    'raw_red stddev'
-        ]
-        newkeys = ['Timestamp', '# Samples', 'Wavelength', 'Photod. I (A)', 'Photod. QE',
-            'Violet', 'StdDev', 'Violet (raw)', 'StdDev',
-            'Blue',   'StdDev',   'Blue (raw)', 'StdDev',
-            'Green',  'StdDev',  'Green (raw)', 'StdDev',
-            'Yellow', 'StdDev', 'Yellow (raw)', 'StdDev',
-            'Orange', 'StdDev', 'Orange (raw)', 'StdDev',
-            'Red',    'StdDev',    'Red (raw)', 'StdDev'
-        ]
-        for old,new in zip(oldkeys,newkeys):
-            stats[new] = stats.pop(old)
-        # CSV file generation
-        writeheader = not os.path.exists(self.options['csv_file'])
-        with open(self.options['csv_file'], mode='a+') as csv_file:
-            writer = csv.DictWriter(csv_file, fieldnames=newkeys, delimiter=';', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-            if writeheader:
-                writer.writeheader()
-            writer.writerow(stats)
-        log.info("updated CSV file {file}",file=self.options['csv_file'])
-
-    
+        stats['quantum_eff'] = self.qe[w]
+        # Columns by position, as the readable header repeats 'StdDev'
+        row = [ stats[key] for key in SUMMARY_KEYS ]
+        if self.multi:
+            self.writer.write(self.options['csv_file'], [tagged(row, device)], header=tagged(SUMMARY_HEADER, 'Device'))
+        else:
+            self.writer.write(self.options['csv_file'], [row], header=SUMMARY_HEADER)
+
+
+    def saveLux(self, stats, device):
+        '''Queues the OPT3001 summary statistics to be appended to the common CSV file'''
+        log.debug("Appending to CSV file {file}",file=self.options['csv_lux'])
+        tstamp = (datetime.datetime.utcnow() + datetime.timedelta(seconds=0.5)).strftime(TSTAMP_FORMAT)
+        row  = [tstamp, stats['N'], stats['wavelength'], stats['lux'], stats['lux stddev'], stats['lux min'], stats['lux max']]
+        if self.multi:
+            self.writer.write(self.options['csv_lux'], [tagged(row, device)], header=tagged(LUX_HEADER, 'Device'))
+        else:
+            self.writer.write(self.options['csv_lux'], [row], header=LUX_HEADER)
     
 
 __all__ = [ "StorageService" ]
\ No newline at end of file
@@ -10,6 +10,7 @@
 
 from __future__ import division, absolute_import
 
+import os.path
 import sys
 import datetime
 
@@ -36,6 +37,33 @@ setSystemTime = None
 # Module Utility Functions
 # ------------------------
 
+def deviceIds(paths):
+    '''
+    Short unique device ids from serial port or capture file paths,
+    i.e. /dev/ttyUSB0 => ttyUSB0
+    '''
+    ids = []
+    for path in paths:
+        base = os.path.splitext(os.path.basename(path))[0] or 'device'
+        name, n = base, 1
+        while name in ids:
+            n += 1
+            name = '{0}-{1}'.format(base, n)
+        ids.append(name)
+    return ids
+
+
+def devicePath(path, device):
+    '''File path tagged with a device id, i.e. samples.csv => samples-ttyUSB0.csv'''
+    root, ext = os.path.splitext(path)
+    return '{0}-{1}{2}'.format(root, device, ext)
+
+
+def serviceName(name, device):
+    '''Name of a per device child service'''
+    return '{0} [{1}]'.format(name, device)
+
+
 def chop(string, sep=None):
     '''Chop a list of strings, separated by sep and 
     strips individual string items from leading and trailing blanks'''
@@ -0,0 +1,71 @@
+# ----------------------------------------------------------------------
+# Copyright (c) 2014 Rafael Gonzalez.
+#
+# See the LICENSE file for details
+# ----------------------------------------------------------------------
+
+#--------------------
+# System wide imports
+# -------------------
+
+from __future__ import division, absolute_import
+
+import multiprocessing
+
+# ---------------
+# Twisted imports
+# ---------------
+
+from twisted.logger           import Logger
+from twisted.internet.threads import deferToThread
+
+#--------------
+# local imports
+# -------------
+
+# ----------------
+# Module constants
+# ----------------
+
+# -----------------------
+# Module global variables
+# -----------------------
+
+log = Logger(namespace='as7262')
+
+# -------
+# Classes
+# -------
+
+class WorkerPool(object):
+    '''
+    Pool of worker processes for CPU bound tasks (statistics and table
+    rendering), so that several devices are processed in parallel
+    without blocking the reactor.
+    Tasks must be module level functions with picklable arguments.
+
+    The pool must be created before the reactor starts any thread,
+    as worker processes are forked.
+    '''
+
+    def __init__(self, processes):
+        self.processes = processes
+        self.pool      = multiprocessing.Pool(processes)
+        log.info("started {n} worker processes", n=processes)
+
+    def run(self, func, *args):
+        '''
+        Runs func(*args) in a worker process.
+        Returns a Deferred fired in the reactor thread with its result.
+        '''
+        return deferToThread(self.pool.apply, func, args)
+
+    def stop(self):
+        '''Ends the worker processes, even those stuck in a task'''
+        self.pool.terminate()
+        self.pool.join()
+
+
+__all__ = [
+    "WorkerPool",
+]
@@ -24,8 +24,10 @@ DEPENDENCIES = [
                   'tabulate'
                 ]
 
-if sys.version_info[0] == 2:
-  DEPENDENCIES.append('statistics')
+# Optional, vectorized statistics engine and zero-copy sample log reader
+EXTRAS       = {
+                  'numpy': ['numpy'],
+                }
 
 CLASSIFIERS  = [
     'Environment :: Console',
@@ -62,6 +64,7 @@ setup(name             = PKG_NAME,
       classifiers      = CLASSIFIERS,
       packages         = PACKAGES,
       install_requires = DEPENDENCIES,
+      extras_require   = EXTRAS,
       data_files       = DATA_FILES,
       package_data     = PACKAGE_DATA
       )